@@ -0,0 +1,119 @@
+import argparse
+import importlib
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# name -> (module, arguments its reformat_pdf takes after maintain_aspect_ratio)
+SCRIPT_PIPELINES = {
+    "modern": ("Modern", (True, True)),  # rasterize, text_layer
+    "svg": ("svg", (True,)),  # rasterize
+    "app2": ("app2", ()),
+    "gui": ("gui", ()),
+}
+ENGINE_PIPELINES = ["engine-vector", "engine-raster"]
+PIPELINES = list(SCRIPT_PIPELINES) + ENGINE_PIPELINES
+
+class _Channel:
+    # Stands in for the tkprogress.ProgressChannel the GUI scripts report to
+    cancel_event = None
+    total_pages = 0
+
+    def report(self, percent):
+        self.value = percent
+
+def run_pipeline(name, input_pdf, output_pdf, num_pages, dpi):
+    if name in ENGINE_PIPELINES:
+        from pdfedit import engine
+        engine.reformat_pdf(input_pdf, output_pdf, num_pages, False, dpi, True, rasterize=name == "engine-raster")
+        return
+
+    module_name, extra_args = SCRIPT_PIPELINES[name]
+    module = importlib.import_module(module_name)
+    args = [input_pdf, output_pdf, num_pages, False, dpi, True, *extra_args]
+    # The scripts report through a progress channel and raise on failure
+    module.reformat_pdf(*args, _Channel())
+
+def run_one(name, input_pdf, num_pages, dpi):
+    # Runs in a fresh interpreter so peak RSS belongs to this pipeline alone
+    fd, output_pdf = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    result = {"ok": True, "error": ""}
+    start = time.perf_counter()
+    try:
+        run_pipeline(name, input_pdf, output_pdf, num_pages, dpi)
+    except Exception as e:
+        result.update(ok=False, error=str(e))
+    result["seconds"] = time.perf_counter() - start
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    result["output_bytes"] = os.path.getsize(output_pdf) if result["ok"] else 0
+    os.remove(output_pdf)
+    print(json.dumps(result))
+
+def measure(name, input_pdf, num_pages, dpi, timeout):
+    cmd = [sys.executable, os.path.abspath(__file__), "--run-one", name, input_pdf, str(num_pages), str(dpi)]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"ok": False, "error": f"timed out after {timeout}s", "seconds": timeout, "peak_rss_mb": 0, "output_bytes": 0}
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        error = proc.stderr.strip().splitlines()[-1:] or ["no output"]
+        return {"ok": False, "error": error[0], "seconds": 0, "peak_rss_mb": 0, "output_bytes": 0}
+    return json.loads(lines[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the reformatting pipelines on synthetic input.")
+    parser.add_argument("--pipelines", nargs="+", default=PIPELINES, choices=PIPELINES)
+    parser.add_argument("--kinds", nargs="+", default=["text", "image", "mixed"], choices=["text", "image", "mixed"])
+    parser.add_argument("--page-counts", nargs="+", type=int, default=[10, 100, 1000], help="input sizes, up to 10000 pages")
+    parser.add_argument("--dpi", nargs="+", type=int, default=[72, 150, 300])
+    parser.add_argument("--pages-per-sheet", nargs="+", type=int, default=[2, 4])
+    parser.add_argument("--input-dir", default=os.path.join(tempfile.gettempdir(), "pdfedit-bench"), help="where generated inputs are kept between runs")
+    parser.add_argument("--timeout", type=int, default=3600, help="seconds before a single run is abandoned")
+    parser.add_argument("--json", help="also write every result as JSON lines to this file")
+    parser.add_argument("--run-one", nargs=4, metavar=("PIPELINE", "INPUT", "PAGES_PER_SHEET", "DPI"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_one:
+        name, input_pdf, num_pages, dpi = args.run_one
+        run_one(name, input_pdf, int(num_pages), int(dpi))
+        return 0
+
+    from synthetic import ensure_input
+    os.makedirs(args.input_dir, exist_ok=True)
+    json_out = open(args.json, "w") if args.json else None
+
+    print(f"{'input':<12} {'pipeline':<14} {'n-up':>4} {'dpi':>5} {'pages/s':>9} {'peak MB':>8} {'output MB':>10}")
+    for kind, page_count in itertools.product(args.kinds, args.page_counts):
+        input_pdf = ensure_input(args.input_dir, kind, page_count)
+        for num_pages, dpi, name in itertools.product(args.pages_per_sheet, args.dpi, args.pipelines):
+            if name == "engine-vector" and dpi != args.dpi[0]:
+                continue  # DPI does not affect the vector path
+            result = measure(name, input_pdf, num_pages, dpi, args.timeout)
+            result.update(input=kind, pages=page_count, pipeline=name, pages_per_sheet=num_pages, dpi=dpi)
+            label = f"{kind}-{page_count}"
+            if result["ok"]:
+                rate = page_count / result["seconds"] if result["seconds"] else float("inf")
+                result["pages_per_second"] = rate
+                print(f"{label:<12} {name:<14} {num_pages:>4} {dpi:>5} {rate:>9.1f} {result['peak_rss_mb']:>8.1f} {result['output_bytes'] / 1e6:>10.2f}")
+            else:
+                print(f"{label:<12} {name:<14} {num_pages:>4} {dpi:>5}   failed: {result['error']}")
+            if json_out:
+                json_out.write(json.dumps(result) + "\n")
+                json_out.flush()
+
+    if json_out:
+        json_out.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
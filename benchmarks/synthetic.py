@@ -0,0 +1,65 @@
+import os
+import random
+import fitz  # PyMuPDF
+
+LOREM = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore "
+         "et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut "
+         "aliquip ex ea commodo consequat.").split()
+
+MIXED_SIZES = ["a4", "letter-l", "a3", "a5", "legal"]
+
+def _fill_text(page, rng):
+    y = 60
+    while y < page.rect.height - 60:
+        line = " ".join(rng.choice(LOREM) for _ in range(12))
+        page.insert_text((50, y), line, fontsize=10)
+        y += 14
+
+def _noise_pixmap(rng, width=640, height=480):
+    samples = rng.randbytes(width * height * 3)
+    return fitz.Pixmap(fitz.csRGB, width, height, samples, False)
+
+def make_text_pdf(path, num_pages, seed=0):
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(num_pages):
+        _fill_text(doc.new_page(), rng)
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+
+def make_image_pdf(path, num_pages, seed=0, distinct_images=8):
+    # Noisy images do not compress, which is the worst case for the raster pipelines
+    rng = random.Random(seed)
+    images = [_noise_pixmap(rng) for _ in range(min(distinct_images, num_pages))]
+    doc = fitz.open()
+    for i in range(num_pages):
+        page = doc.new_page()
+        page.insert_image(page.rect + (36, 36, -36, -36), pixmap=images[i % len(images)])
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+
+def make_mixed_pdf(path, num_pages, seed=0):
+    rng = random.Random(seed)
+    image = _noise_pixmap(rng, 320, 240)
+    doc = fitz.open()
+    for i in range(num_pages):
+        rect = fitz.paper_rect(MIXED_SIZES[i % len(MIXED_SIZES)])
+        page = doc.new_page(width=rect.width, height=rect.height)
+        _fill_text(page, rng)
+        if i % 3 == 0:
+            page.insert_image(fitz.Rect(50, 50, 50 + rect.width / 3, 50 + rect.height / 4), pixmap=image)
+        page.draw_rect(page.rect + (20, 20, -20, -20), color=(0.2, 0.2, 0.8), width=2)
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+
+GENERATORS = {
+    "text": make_text_pdf,
+    "image": make_image_pdf,
+    "mixed": make_mixed_pdf,
+}
+
+def ensure_input(directory, kind, num_pages):
+    path = os.path.join(directory, f"{kind}-{num_pages}.pdf")
+    if not os.path.exists(path):
+        GENERATORS[kind](path, num_pages)
+    return path
@@ -0,0 +1,4 @@
+# The reformatter as a package: engine.reformat_pdf does the work, cli and spool run it from the
+# command line and a watch folder, the scripts at the top of the repository put a window on it.
+# Nothing is imported here, so `python -m pdfedit --help` starts without loading MuPDF or PIL; every
+# module pulls in its heavy libraries itself, and backends only when they are chosen.
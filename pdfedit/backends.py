@@ -0,0 +1,33 @@
+# How source pages get onto the sheets. Nothing heavy is imported here; each backend pulls in its
+# own libraries the first time it is used.
+BACKENDS = {
+    "vector": "place pages as vectors, nothing is rendered",
+    "fitz": "render pages to images with MuPDF",
+    "poppler": "render pages to images with poppler (pdf2image)",
+}
+DEFAULT_BACKEND = "vector"
+
+def resolve_backend(backend, rasterize):
+    # backend wins when given; otherwise the older rasterize flag picks fitz or vector
+    if backend is None:
+        backend = "fitz" if rasterize else DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of: {', '.join(BACKENDS)}")
+    return backend
+
+def load_renderer(backend):
+    # The renderer raster pages are drawn with, or None for MuPDF, which raster.py calls directly
+    if backend == "poppler":
+        return PopplerRenderer()
+    return None
+
+class PopplerRenderer:
+    # Renders a page with pdftoppm straight from the file it lives in, at exactly the pixel size the
+    # raster path asks for. Pages too big for the pixel budget are still rendered in bands by MuPDF.
+    def render(self, page, pixel_size, gray):
+        from pdf2image import convert_from_path
+        images = convert_from_path(page.parent.name, first_page=page.number + 1, last_page=page.number + 1, size=pixel_size, grayscale=gray)
+        img = images[0]
+        if img.size != tuple(pixel_size):
+            img = img.resize(pixel_size)
+        return img.convert("L" if gray else "RGB")
@@ -0,0 +1,179 @@
+import bisect
+import hashlib
+import os
+import re
+import threading
+import fitz  # PyMuPDF
+
+def _natural_key(name):
+    # "scan2.pdf" sorts before "scan10.pdf"
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+def resolve_inputs(input_pdf):
+    # A single file, a directory (its PDF files in name order) or a list of files in the given order
+    if isinstance(input_pdf, (str, os.PathLike)):
+        if os.path.isdir(input_pdf):
+            names = sorted((name for name in os.listdir(input_pdf) if name.lower().endswith(".pdf")), key=_natural_key)
+            if not names:
+                raise ValueError(f"No PDF files in {input_pdf}")
+            return [os.path.join(input_pdf, name) for name in names]
+        return [input_pdf]
+    paths = list(input_pdf)
+    if not paths:
+        raise ValueError("No input files given")
+    return paths
+
+def open_input(input_pdf, readahead=2):
+    # A plain fitz document for one file, a PageStream for several
+    paths = resolve_inputs(input_pdf)
+    if len(paths) == 1:
+        return fitz.open(paths[0])
+    return PageStream(paths, readahead)
+
+def parse_ranges(text, count):
+    # Sorted 0-based indices out of count from 1-based ranges such as "1-3,7,10-"; "-5" is 1-5 and
+    # "10-" runs to the end. Numbers past the end are left out.
+    selected = set()
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, dash, last = part.partition("-")
+        try:
+            start = int(first) if first.strip() else 1
+            end = (int(last) if last.strip() else count) if dash else start
+        except ValueError:
+            raise ValueError(f"Bad range {part!r}, expected numbers such as 1-3,7,10-")
+        if start < 1 or end < start:
+            raise ValueError(f"Bad range {part!r}")
+        selected.update(range(start - 1, min(end, count)))
+    if not selected:
+        raise ValueError(f"{text!r} selects nothing out of {count}")
+    return sorted(selected)
+
+def locate_page(pdf_reader, page_num):
+    # (document, page number in that document) for a page of a fitz document or a PageStream
+    if isinstance(pdf_reader, PageStream):
+        index, local_num = pdf_reader.locate(page_num)
+        return pdf_reader.docs[index], local_num
+    return pdf_reader, page_num
+
+def input_digest(input_pdf):
+    from .cache import file_digest
+    paths = resolve_inputs(input_pdf)
+    if len(paths) == 1:
+        return file_digest(paths[0])
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+class PageStream:
+    # Several input files read as one continuous run of pages. load_page returns an ordinary fitz
+    # page of the file it came from; locate_page gives that document and the page number in it.
+    # Opening a file only parses its cross-reference table; the page content is read as pages are
+    # loaded. A read-ahead thread pulls the next files into the OS cache while the current ones are
+    # rendered, so slow storage is not waited on in the render loop. MuPDF is not thread-safe, so
+    # the pages themselves are still decoded on the caller's thread.
+    # Every file stays open until the stream is closed: fitz remembers the source documents it has
+    # placed pages from, and a closed one could be mistaken for a new one.
+    def __init__(self, paths, readahead=2):
+        self.paths = list(paths)
+        self.docs = []
+        self.starts = []
+        total = 0
+        try:
+            for path in self.paths:
+                doc = fitz.open(path)
+                self.docs.append(doc)
+                self.starts.append(total)
+                total += len(doc)
+        except Exception:
+            self.close()
+            raise
+        self.page_count = total
+        # Started at the first page loaded, so a job that begins deep in the stream does not read
+        # the files before it
+        self.readahead = readahead
+        self._prefetcher = None
+
+    def __len__(self):
+        return self.page_count
+
+    def locate(self, page_num):
+        # Every way into the stream (load_page, locate_page) comes through here, so this is where
+        # the read-ahead learns which file is in use
+        if not 0 <= page_num < self.page_count:
+            raise IndexError(f"page {page_num} not in stream of {self.page_count} pages")
+        index = bisect.bisect_right(self.starts, page_num) - 1
+        if self._prefetcher is not None:
+            self._prefetcher.advance(index)
+        elif self.readahead > 0:
+            self._prefetcher = _ReadAhead(self.paths, self.readahead, index)
+        return index, page_num - self.starts[index]
+
+    def load_page(self, page_num):
+        index, local_num = self.locate(page_num)
+        return self.docs[index].load_page(local_num)
+
+    def __getitem__(self, page_num):
+        return self.load_page(page_num)
+
+    def close(self):
+        if getattr(self, "_prefetcher", None) is not None:
+            self._prefetcher.stop()
+        for doc in self.docs:
+            doc.close()
+        self.docs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class _ReadAhead:
+    # Reads the files after the one in use, up to readahead of them, once each per pass. Going back
+    # to an earlier file starts a new pass: a job first reads every page size to plan the sheets,
+    # then goes through the pages again to draw them.
+    def __init__(self, paths, readahead, current=0):
+        self.paths = paths
+        self.readahead = readahead
+        self.current = current
+        self.next_to_read = current + 1
+        self.stopped = False
+        self.condition = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def advance(self, index):
+        with self.condition:
+            if index != self.current:
+                if index < self.current:
+                    self.next_to_read = index + 1
+                self.current = index
+                self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                # Files up to the current one are already open and being read by MuPDF
+                self.next_to_read = max(self.next_to_read, self.current + 1)
+                while not self.stopped and self.next_to_read < len(self.paths) and self.next_to_read > self.current + self.readahead:
+                    self.condition.wait()
+                    self.next_to_read = max(self.next_to_read, self.current + 1)
+                if self.stopped or self.next_to_read >= len(self.paths):
+                    return
+                path = self.paths[self.next_to_read]
+                self.next_to_read += 1
+            try:
+                with open(path, "rb") as f:
+                    while f.read(1 << 20):
+                        if self.stopped:
+                            return
+            except OSError:
+                pass
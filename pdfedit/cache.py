@@ -0,0 +1,183 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from PIL import Image
+
+_ENTRY = re.compile(r"^([0-9a-f]{64})-(\d+)-(\d+)x(\d+)\.rgbz$")
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class RenderCache:
+    # Page rasters keyed by (input digest, page number, pixel size). A bounded in-memory LRU
+    # sits in front of an optional on-disk store that evicts its least recently used files
+    # once it grows past disk_limit. A request for a smaller size than is cached is served
+    # by downsampling the cached raster instead of rendering the page again.
+    # The disk store is listed once when the cache opens; disk_entries then follows every store and
+    # eviction, so a lookup never lists the directory. Entries other processes add later are still
+    # found at their exact size.
+
+    def __init__(self, directory=None, memory_limit=256 * 1024 * 1024, disk_limit=2 * 1024 * 1024 * 1024):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.disk_size = 0
+        self.disk_entries = {}  # (digest, page_num) -> {(width, height): file size}
+        self.lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            for entry in os.scandir(directory):
+                match = _ENTRY.match(entry.name)
+                if match:
+                    self._index(match, entry.stat().st_size)
+
+    def __reduce__(self):
+        # Worker processes get an empty cache with the same settings, sharing only the disk store
+        return (RenderCache, (self.directory, self.memory_limit, self.disk_limit))
+
+    def for_document(self, digest):
+        return DocumentCache(self, digest)
+
+    def get(self, digest, page_num, size):
+        image = self._lookup(digest, page_num, size)
+        if image is None:
+            return None
+        if image.size != tuple(size):
+            image = image.resize(size, Image.LANCZOS)
+            self.put(digest, page_num, image)
+        return image
+
+    def put(self, digest, page_num, image):
+        key = (digest, page_num, image.size)
+        with self.lock:
+            self._remember(key, image)
+        if self.directory is not None:
+            self._store(key, image)
+
+    def _lookup(self, digest, page_num, size):
+        size = tuple(size)
+        with self.lock:
+            image = self.memory.get((digest, page_num, size))
+            if image is not None:
+                self.memory.move_to_end((digest, page_num, size))
+                return image
+            # Any larger raster of the same page can be scaled down
+            larger = [key for key in self.memory if key[:2] == (digest, page_num) and key[2][0] >= size[0] and key[2][1] >= size[1]]
+            if larger:
+                return self.memory[min(larger, key=lambda key: key[2][0] * key[2][1])]
+        if self.directory is None:
+            return None
+        return self._load(digest, page_num, size)
+
+    def _remember(self, key, image):
+        nbytes = image.width * image.height * len(image.getbands())
+        if nbytes > self.memory_limit:
+            return
+        if key in self.memory:
+            return
+        self.memory[key] = image
+        self.memory_size += nbytes
+        while self.memory_size > self.memory_limit:
+            _, old = self.memory.popitem(last=False)
+            self.memory_size -= old.width * old.height * len(old.getbands())
+
+    def _path(self, digest, page_num, size):
+        return os.path.join(self.directory, f"{digest}-{page_num}-{size[0]}x{size[1]}.rgbz")
+
+    def _index(self, match, nbytes):
+        # Called with lock held, or before the cache is shared
+        sizes = self.disk_entries.setdefault((match.group(1), int(match.group(2))), {})
+        size = (int(match.group(3)), int(match.group(4)))
+        self.disk_size += nbytes - sizes.get(size, 0)
+        sizes[size] = nbytes
+
+    def _unindex(self, path):
+        match = _ENTRY.match(os.path.basename(path))
+        sizes = self.disk_entries.get((match.group(1), int(match.group(2))), {})
+        self.disk_size -= sizes.pop((int(match.group(3)), int(match.group(4))), 0)
+        if not sizes:
+            self.disk_entries.pop((match.group(1), int(match.group(2))), None)
+
+    def _load(self, digest, page_num, size):
+        with self.lock:
+            sizes = self.disk_entries.get((digest, page_num), {})
+            larger = [candidate for candidate in sizes if candidate[0] >= size[0] and candidate[1] >= size[1]]
+        if larger:
+            path = self._path(digest, page_num, min(larger, key=lambda candidate: candidate[0] * candidate[1]))
+        else:
+            path = self._path(digest, page_num, size)
+            if not os.path.exists(path):
+                return None
+        match = _ENTRY.match(os.path.basename(path))
+        try:
+            with open(path, "rb") as f:
+                data = zlib.decompress(f.read())
+            os.utime(path)  # mark as recently used for eviction
+        except (OSError, zlib.error):
+            # Evicted by another process in the meantime
+            with self.lock:
+                self._unindex(path)
+            return None
+        image = Image.frombytes("RGB", (int(match.group(3)), int(match.group(4))), data)
+        with self.lock:
+            self._remember((digest, page_num, image.size), image)
+        return image
+
+    def _store(self, key, image):
+        path = self._path(*key)
+        if os.path.exists(path):
+            return
+        data = zlib.compress(image.convert("RGB").tobytes(), 1)
+        # Write to a temporary name first so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self._index(_ENTRY.match(os.path.basename(path)), len(data))
+            if self.disk_size > self.disk_limit:
+                self._evict()
+
+    def _evict(self):
+        # Drop the least recently used entries until the store is back under 90% of its limit. Other
+        # processes may share the directory, so it is listed again here and the index rebuilt from it.
+        entries = []
+        for entry in os.scandir(self.directory):
+            if _ENTRY.match(entry.name):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        self.disk_entries = {}
+        self.disk_size = 0
+        for _, size, path in entries:
+            self._index(_ENTRY.match(os.path.basename(path)), size)
+        for _, size, path in entries:
+            if self.disk_size <= self.disk_limit * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._unindex(path)
+
+class DocumentCache:
+    def __init__(self, cache, digest):
+        self.cache = cache
+        self.digest = digest
+
+    def get(self, page_num, size):
+        return self.cache.get(self.digest, page_num, size)
+
+    def put(self, page_num, image):
+        self.cache.put(self.digest, page_num, image)
@@ -0,0 +1,77 @@
+import json
+import logging
+import os
+import fitz  # PyMuPDF
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+class Checkpoint:
+    # A work directory holding every finished sheet as its own small PDF, next to a manifest of the
+    # input hash and settings. A restarted job with the same manifest skips the sheets already there;
+    # a different input or different settings start the directory over.
+    def __init__(self, directory, input_digest, settings):
+        self.directory = directory
+        self.manifest = {"version": MANIFEST_VERSION, "input_sha256": input_digest, "settings": settings}
+        os.makedirs(directory, exist_ok=True)
+
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        existing = None
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path) as f:
+                    existing = json.load(f)
+            except (OSError, ValueError):
+                pass
+        if existing != self.manifest:
+            if existing is not None:
+                logger.warning(f"Checkpoint in {directory} belongs to a different input or settings, starting over")
+            self._remove_sheets()
+            self._write_atomic(manifest_path, json.dumps(self.manifest, indent=2).encode())
+
+    def sheet_path(self, sheet_index):
+        return os.path.join(self.directory, f"sheet-{sheet_index:06d}.pdf")
+
+    def has(self, sheet_index):
+        return os.path.exists(self.sheet_path(sheet_index))
+
+    def save(self, sheet_indices, doc):
+        # doc holds one page per entry of sheet_indices, in the same order
+        for pos, sheet_index in enumerate(sheet_indices):
+            if len(doc) == 1:
+                data = doc.tobytes(garbage=3, deflate=True)
+            else:
+                with fitz.open() as single:
+                    single.insert_pdf(doc, from_page=pos, to_page=pos)
+                    data = single.tobytes(garbage=3, deflate=True)
+            self._write_atomic(self.sheet_path(sheet_index), data)
+
+    def open_sheet(self, sheet_index):
+        return fitz.open(self.sheet_path(sheet_index))
+
+    def clear(self):
+        # Called once the output is complete; the directory itself goes too if nothing else is in it
+        self._remove_sheets()
+        manifest_path = os.path.join(self.directory, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        try:
+            os.rmdir(self.directory)
+        except OSError:
+            pass
+
+    def _remove_sheets(self):
+        for name in os.listdir(self.directory):
+            if name.startswith("sheet-") and name.endswith((".pdf", ".tmp")):
+                os.remove(os.path.join(self.directory, name))
+
+    def _write_atomic(self, path, data):
+        # A sheet only counts as done once its file is complete, so a crash mid-write is never mistaken for one
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
@@ -0,0 +1,104 @@
+import argparse
+import logging
+import sys
+from .backends import BACKENDS
+from .timing import NULL_TIMER, StageTimer
+
+def _grid(text):
+    try:
+        rows, cols = (int(part) for part in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected ROWSxCOLS, e.g. 2x2, not {text!r}")
+    return rows, cols
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m pdfedit", description="Combine several PDF pages onto each landscape A4 sheet.")
+    parser.add_argument("input_pdf", nargs="+", help="PDF file to reformat; several files or a directory are combined in order")
+    parser.add_argument("output_pdf", help="where to write the reformatted PDF")
+    parser.add_argument("-n", "--pages", type=int, default=2, dest="num_pages", help="number of pages per sheet (default: 2)")
+    parser.add_argument("--grid", type=_grid, metavar="ROWSxCOLS", help="lay pages out in a grid, e.g. 2x2, instead of --pages side by side")
+    parser.add_argument("--booklet", action="store_true", help="order pages for a saddle-stitched booklet, two per sheet side; print double-sided and fold")
+    parser.add_argument("--sheet-size", default="a4-l", help="output sheet: a paper name such as a4-l, a3 or letter-l, or WIDTHxHEIGHT in mm (default: a4-l)")
+    parser.add_argument("--margin", type=float, default=0, help="blank border around the sheet in mm (default: 0)")
+    parser.add_argument("--gutter", type=float, default=0, help="space between pages in mm (default: 0)")
+    parser.add_argument("--page-range", metavar="RANGES", help="only use these input pages, e.g. 1-10,15,40- (counting from 1)")
+    parser.add_argument("--sheet-range", metavar="RANGES", help="only write these sheets of the job, e.g. 400-420; other pages are not read")
+    parser.add_argument("--dpi", type=int, default=150, help="resolution of the rendered pages on the output sheet with --rasterize (default: 150)")
+    parser.add_argument("--separate-with-line", action="store_true", help="draw a line between pages")
+    parser.add_argument("--stretch", action="store_false", dest="maintain_aspect_ratio", help="fill each slot instead of keeping the aspect ratio")
+    parser.add_argument("--backend", choices=list(BACKENDS), help="how pages are put on the sheets: " + "; ".join(f"{name}: {text}" for name, text in BACKENDS.items()))
+    parser.add_argument("--rasterize", action="store_true", help="render pages to images instead of placing them as vectors (same as --backend fitz)")
+    parser.add_argument("--text-layer", action="store_true", help="with --rasterize, keep the text searchable as an invisible layer")
+    parser.add_argument("--passthrough", action="store_true", help="with --rasterize, place scanned pages (one JPEG or CCITT image) with their original image")
+    parser.add_argument("--composite", action="store_true", help="with --rasterize, store each sheet as one image instead of one image per page")
+    parser.add_argument("--codec", choices=["flate", "jpeg"], default="flate", help="how raster pages are compressed (default: flate)")
+    parser.add_argument("--jpeg-quality", type=int, default=85, help="JPEG quality from 1 to 95 (default: 85)")
+    parser.add_argument("--color-mode", choices=["auto", "rgb", "gray", "bilevel"], default="auto",
+                        help="store raster pages in colour, 8-bit gray or 1-bit; auto picks per page (default: auto)")
+    parser.add_argument("--max-render-mb", type=int, default=256,
+                        help="largest single page render in MB; bigger pages are rendered in bands (default: 256)")
+    parser.add_argument("--dedup", action="store_true", help="render and store pages that repeat only once")
+    parser.add_argument("--skip-blank", action="store_true", help="leave blank pages out of the output")
+    parser.add_argument("--raster-check", action="store_true", help="also compare rendered pixels to find blank and repeated pages (slower)")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="number of worker processes rendering sheets (default: 1)")
+    parser.add_argument("--pipeline", type=int, default=0, metavar="THREADS",
+                        help="with --rasterize, render, encode and write in overlapping stages using this many encode threads (default: 0, off)")
+    parser.add_argument("--streaming", action="store_true", help="write each sheet to the output as soon as it is finished, keeping memory use flat")
+    parser.add_argument("--checkpoint-dir", help="save finished sheets here; rerunning the same job resumes where it stopped")
+    parser.add_argument("--cache-dir", help="keep rendered pages here so later runs on the same input can reuse them")
+    parser.add_argument("--cache-size", type=int, default=2048, help="size limit of --cache-dir in MB (default: 2048)")
+    parser.add_argument("--trace", help="write per-sheet stage timings to this file as JSON lines")
+    parser.add_argument("--timings", action="store_true", help="log a summary of the time spent in each stage")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not print progress")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # Imported only now, so --help and usage errors do not wait for PyMuPDF to load
+    from . import engine
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    def progress(percent):
+        print(f"\r{percent:5.1f}%", end="", file=sys.stderr, flush=True)
+
+    cache = None
+    if args.cache_dir:
+        from .cache import RenderCache
+        cache = RenderCache(args.cache_dir, disk_limit=args.cache_size * 1024 * 1024)
+
+    encoding = None
+    if args.rasterize or args.backend not in (None, "vector"):
+        from .encoding import ImageEncoding
+        encoding = ImageEncoding(args.codec, args.jpeg_quality, args.color_mode)
+
+    timer = NULL_TIMER
+    if args.trace or args.timings:
+        timer = StageTimer(args.trace)
+
+    input_pdf = args.input_pdf[0] if len(args.input_pdf) == 1 else args.input_pdf
+    try:
+        from .imposition import MM, Layout, parse_sheet_size
+        rows, cols = args.grid or (1, 2 if args.booklet else args.num_pages)
+        sheet_width, sheet_height = parse_sheet_size(args.sheet_size)
+        layout = Layout(rows, cols, sheet_width, sheet_height, args.margin * MM, args.gutter * MM, "booklet" if args.booklet else "sequential",
+                        args.maintain_aspect_ratio, args.separate_with_line)
+        engine.reformat_pdf(input_pdf, args.output_pdf, num_pages=args.num_pages, separate_with_line=args.separate_with_line, dpi=args.dpi,
+                            maintain_aspect_ratio=args.maintain_aspect_ratio, rasterize=args.rasterize, workers=args.workers, streaming=args.streaming,
+                            cache=cache, timer=timer, text_layer=args.text_layer, encoding=encoding, pixel_budget=args.max_render_mb * 1024 * 1024,
+                            checkpoint_dir=args.checkpoint_dir, dedup=args.dedup, skip_blank=args.skip_blank, raster_check=args.raster_check,
+                            backend=args.backend, passthrough=args.passthrough, composite=args.composite, pipeline=args.pipeline, layout=layout,
+                            page_range=args.page_range, sheet_range=args.sheet_range, progress=None if args.quiet else progress)
+    except Exception as e:
+        if not args.quiet:
+            print(file=sys.stderr)
+        logging.error(f"Error reformatting PDF: {str(e)}")
+        return 1
+    finally:
+        if timer is not NULL_TIMER:
+            timer.close()
+    if not args.quiet:
+        print(file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
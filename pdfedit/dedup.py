@@ -0,0 +1,169 @@
+import hashlib
+import re
+from collections import namedtuple
+import fitz  # PyMuPDF
+from .batch import locate_page
+
+# canonical: page -> first page with the same fingerprint, for every page that repeats an earlier one
+# repeated: pages that at least one later page is a copy of
+# blank: pages that draw nothing
+DuplicatePages = namedtuple("DuplicatePages", ["canonical", "repeated", "blank"])
+
+_REF = re.compile(r"(\d+) 0 R")
+# Back-links to the page tree or to the owning page would pull the whole document into every hash
+_BACKLINK = re.compile(r"/(?:Parent|P)\s*\d+ 0 R")
+
+class PageFingerprinter:
+    # Hashes what a page draws: its decoded content, and its resources and annotations with every
+    # referenced object replaced by the hash of that object. Copies of a page that were merged in
+    # from another file have their own xrefs but still get the same fingerprint.
+    # References to pages (link destinations, /A <</D ...>> actions) stand for an opaque token, or
+    # every link would pull the page it points to, and from there the rest of the document, into the
+    # hash. Objects are walked with an explicit stack, so deep chains of references cannot exhaust
+    # Python's recursion limit.
+    def __init__(self, doc):
+        self.doc = doc
+        self._object_hashes = {}
+        self._pages = {}
+
+    def object_hash(self, xref):
+        # Children first: an object is hashed once every object it refers to has been
+        visiting = set()
+        stack = [xref]
+        while stack:
+            current = stack[-1]
+            if current in self._object_hashes:
+                stack.pop()
+                continue
+            if current not in visiting:
+                visiting.add(current)
+                for child in self._references(current):
+                    if child not in self._object_hashes and child not in visiting and not self._is_page(child):
+                        stack.append(child)
+                continue
+            stack.pop()
+            h = hashlib.sha1()
+            h.update(self._substitute(self._source(current), visiting).encode())
+            if self.doc.xref_is_stream(current):
+                h.update(self.doc.xref_stream_raw(current))
+            self._object_hashes[current] = h.hexdigest()
+        return self._object_hashes[xref]
+
+    def _source(self, xref):
+        return _BACKLINK.sub("", self.doc.xref_object(xref, compressed=True))
+
+    def _references(self, xref):
+        return [int(m.group(1)) for m in _REF.finditer(self._source(xref))]
+
+    def _is_page(self, xref):
+        if xref not in self._pages:
+            self._pages[xref] = self.doc.xref_get_key(xref, "Type") == ("name", "/Page")
+        return self._pages[xref]
+
+    def _substitute(self, source, visiting=()):
+        def token(m):
+            xref = int(m.group(1))
+            if self._is_page(xref):
+                return "page"
+            if xref in self._object_hashes:
+                return self._object_hashes[xref]
+            if xref in visiting:
+                # A reference cycle falls back to the xref itself
+                return f"xref{xref}"
+            return self.object_hash(xref)
+        return _REF.sub(token, source)
+
+    def _resolve(self, source):
+        return self._substitute(_BACKLINK.sub("", source))
+
+    def _page_key(self, xref, key):
+        # Resources may be inherited from a parent node of the page tree
+        while True:
+            kind, value = self.doc.xref_get_key(xref, key)
+            if kind != "null" or key != "Resources":
+                return self._resolve(value)
+            kind, parent = self.doc.xref_get_key(xref, "Parent")
+            if kind != "xref":
+                return ""
+            xref = int(parent.split()[0])
+
+    def fingerprint(self, page, contents=None):
+        h = hashlib.sha1()
+        h.update(repr((tuple(page.rect), page.rotation)).encode())
+        h.update(page.read_contents() if contents is None else contents)
+        h.update(self._page_key(page.xref, "Resources").encode())
+        h.update(self._page_key(page.xref, "Annots").encode())
+        return h.hexdigest()
+
+def is_blank(page, raster_check=False, contents=None):
+    # Nothing in the content stream and no annotations; with raster_check a page whose content only
+    # paints white (or near white) counts as blank too, judged from a small gray render
+    if contents is None:
+        contents = page.read_contents()
+    if not contents.strip() and page.first_annot is None:
+        return True
+    if raster_check:
+        pix = page.get_pixmap(matrix=fitz.Matrix(0.5, 0.5), colorspace=fitz.csGRAY)
+        return min(pix.samples) >= 250
+    return False
+
+def find_duplicates(pdf_reader, raster_check=False, page_numbers=None):
+    # Compares page_numbers, or every page. Object hashes are per document; a batch.PageStream has one
+    # document per input file.
+    fingerprinters = {}
+    first_seen = {}
+    canonical = {}
+    blank = set()
+    for page_num in range(len(pdf_reader)) if page_numbers is None else page_numbers:
+        doc, local_num = locate_page(pdf_reader, page_num)
+        page = doc.load_page(local_num)
+        contents = page.read_contents()
+        if is_blank(page, raster_check, contents):
+            blank.add(page_num)
+        fingerprinter = fingerprinters.get(id(doc))
+        if fingerprinter is None:
+            fingerprinter = fingerprinters[id(doc)] = PageFingerprinter(doc)
+        first = first_seen.setdefault(fingerprinter.fingerprint(page, contents), page_num)
+        if first != page_num:
+            canonical[page_num] = first
+    return DuplicatePages(canonical, set(canonical.values()), blank)
+
+class ImageStore:
+    # Hands out the image XObject already made for a page, so a page that repeats is rendered and
+    # stored once. Within one output document the xref itself is reused. A sheet built in a document
+    # of its own (streaming, checkpoints, workers) gets a copy of the encoded stream for pages known
+    # to repeat, still without rendering again.
+    # With raster_hash, renders are also matched by their pixels, which catches pages that are
+    # built differently but look the same.
+    def __init__(self, duplicates, raster_hash=False):
+        self.duplicates = duplicates
+        self.raster_hash = raster_hash
+        self._doc = None
+        self._xrefs = {}
+        self._encoded = {}
+
+    def source_page(self, page_num):
+        return self.duplicates.canonical.get(page_num, page_num)
+
+    def get(self, doc, key):
+        if doc is not self._doc:
+            self._doc = doc
+            self._xrefs = {}
+        xref = self._xrefs.get(key)
+        if xref is None and key in self._encoded:
+            from .encoding import add_image_xobject
+            xref = self._xrefs[key] = add_image_xobject(doc, self._encoded[key])
+        return xref
+
+    def put(self, doc, keys, encoded, xref):
+        if doc is not self._doc:
+            self._doc = doc
+            self._xrefs = {}
+        for key in keys:
+            self._xrefs[key] = xref
+            # Only pages known to repeat are worth keeping around after this document is done
+            if encoded is not None and key[0] in self.duplicates.repeated:
+                self._encoded[key] = encoded
+
+def pixel_key(img):
+    return ("pixels", hashlib.sha1(img.tobytes()).hexdigest(), img.size, img.mode)
@@ -0,0 +1,60 @@
+import io
+import zlib
+from collections import namedtuple
+from PIL import Image, ImageChops
+
+CODECS = ("flate", "jpeg")
+COLOR_MODES = ("auto", "rgb", "gray", "bilevel")
+
+ImageEncoding = namedtuple("ImageEncoding", ["codec", "quality", "color_mode"], defaults=["flate", 85, "auto"])
+DEFAULT_ENCODING = ImageEncoding()
+
+# An image XObject ready to be written: raw stream bytes plus the dictionary entries describing them
+EncodedImage = namedtuple("EncodedImage", ["data", "width", "height", "colorspace", "bits", "filter"])
+
+def detect_color_mode(img, tolerance=12):
+    # Checks a reduced copy: channels that never differ by more than tolerance make the page gray.
+    # Bilevel only when no detail is lost: the image is 1-bit already, or every one of its pixels
+    # is within tolerance of black or white. Anti-aliased text and gray fills stay gray, as
+    # thresholding them would make thin strokes break up or vanish.
+    if img.mode == "1":
+        return "bilevel"
+    sample = img if max(img.size) <= 512 else img.reduce(max(1, max(img.size) // 512))
+    if sample.mode != "L":
+        sample = sample.convert("RGB")
+        r, g, b = sample.split()
+        for first, second in ((r, g), (g, b), (r, b)):
+            if ImageChops.difference(first, second).getextrema()[1] > tolerance:
+                return "rgb"
+    # The full image: reducing it averages edges into mid-tones
+    histogram = img.convert("L").histogram()
+    if not any(histogram[tolerance + 1:256 - tolerance]):
+        return "bilevel"
+    return "gray"
+
+def encode_image(img, encoding=DEFAULT_ENCODING):
+    color_mode = encoding.color_mode
+    if color_mode == "auto":
+        color_mode = detect_color_mode(img)
+
+    if color_mode == "bilevel":
+        # 1-bit samples, where 1 is white just like in PIL's "1" mode; JPEG has no 1-bit form so this is always Flate
+        bits = img.convert("L").point(lambda value: 255 if value >= 128 else 0).convert("1", dither=Image.Dither.NONE)
+        return EncodedImage(zlib.compress(bits.tobytes(), 6), img.width, img.height, "DeviceGray", 1, "FlateDecode")
+
+    img = img.convert("L" if color_mode == "gray" else "RGB")
+    colorspace = "DeviceGray" if img.mode == "L" else "DeviceRGB"
+    if encoding.codec == "jpeg":
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=encoding.quality, optimize=False)
+        return EncodedImage(buffer.getvalue(), img.width, img.height, colorspace, 8, "DCTDecode")
+    return EncodedImage(zlib.compress(img.tobytes(), 6), img.width, img.height, colorspace, 8, "FlateDecode")
+
+def add_image_xobject(doc, encoded):
+    # Writes the stream exactly as encoded, so fitz does not decode or recompress it
+    xref = doc.get_new_xref()
+    doc.update_object(xref, f"<</Type/XObject/Subtype/Image/Width {encoded.width}/Height {encoded.height}"
+                            f"/ColorSpace/{encoded.colorspace}/BitsPerComponent {encoded.bits}>>")
+    doc.update_stream(xref, encoded.data, new=True, compress=False)
+    doc.xref_set_key(xref, "Filter", f"/{encoded.filter}")
+    return xref
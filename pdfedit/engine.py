@@ -0,0 +1,274 @@
+import contextlib
+import hashlib
+import logging
+import os
+import threading
+import fitz  # PyMuPDF
+from .backends import load_renderer, resolve_backend
+from .batch import input_digest, open_input, parse_ranges
+from .imposition import ImpositionPlan, Layout, check_layout, page_size_reader, sheet_count
+from .timing import NULL_TIMER
+from .vector import create_vector_page
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PIXEL_BUDGET = 256 * 1024 * 1024
+
+def iter_reformat_pdf(input_pdf, output_pdf, num_pages=2, separate_with_line=False, dpi=150, maintain_aspect_ratio=True, rasterize=False, workers=1, streaming=False, cache=None, timer=NULL_TIMER, text_layer=False, encoding=None, pixel_budget=DEFAULT_PIXEL_BUDGET, checkpoint_dir=None, dedup=False, skip_blank=False, raster_check=False, backend=None, passthrough=False, composite=False, pipeline=0, layout=None, page_range=None, sheet_range=None):
+    # input_pdf is a PDF file, a list of them or a directory of them; several files run as one stream of pages.
+    # Yields (sheets_done, num_sheets) after every sheet; the output is written once the iterator is exhausted.
+    # With streaming=True each sheet is appended to output_pdf as soon as it is finished instead.
+    # cache is an optional cache.RenderCache reused across runs so raster jobs skip pages rendered before.
+    # timer is an optional timing.StageTimer that records where the time goes; the caller closes it.
+    # text_layer adds the source text invisibly over raster pages; vector pages keep their own text.
+    # encoding is an encoding.ImageEncoding choosing codec, JPEG quality and colour mode for raster pages.
+    # pixel_budget caps the bytes of a single page render; bigger pages are rendered in bands (None for no limit).
+    # checkpoint_dir keeps every finished sheet on disk; running the same job again resumes after the last one.
+    # dedup renders and stores identical pages once; skip_blank leaves out pages that draw nothing.
+    # raster_check also compares rendered pixels to find blank and identical pages, at the cost of renders.
+    # backend is one of backends.BACKENDS; without it rasterize picks "fitz" or "vector".
+    # passthrough places scanned pages (one JPEG or CCITT image each) with their original image stream.
+    # composite draws each raster sheet as one image instead of one image per page.
+    # pipeline > 0 renders, encodes and writes raster sheets in overlapping stages with that many encode threads.
+    # layout is an imposition.Layout (grid, booklet order, sheet size, margins); it replaces num_pages,
+    # separate_with_line and maintain_aspect_ratio, which describe a single row of pages on landscape A4.
+    # page_range keeps only some input pages, sheet_range only some sheets of the job, both 1-based
+    # ranges like "400-420,500". Only the pages that end up on the output are loaded and rendered.
+    if layout is None:
+        if num_pages <= 0:
+            raise ValueError("Number of pages must be positive")
+        layout = Layout(1, num_pages, maintain_aspect_ratio=maintain_aspect_ratio, separate_with_line=separate_with_line)
+    check_layout(layout)
+    if dpi <= 0:
+        raise ValueError("DPI must be positive")
+    if workers <= 0:
+        raise ValueError("Number of workers must be positive")
+    if pixel_budget is not None and pixel_budget <= 0:
+        raise ValueError("Pixel budget must be positive")
+    if pipeline < 0:
+        raise ValueError("Number of pipeline threads cannot be negative")
+
+    backend = resolve_backend(backend, rasterize)
+    rasterize = backend != "vector"
+    renderer = None
+    if rasterize:
+        # Only pull in PIL (and the renderer's own libraries) when a raster job actually needs it
+        from .raster import composite_fits, create_composite_page, create_raster_page
+        from .encoding import DEFAULT_ENCODING
+        if encoding is None:
+            encoding = DEFAULT_ENCODING
+        renderer = load_renderer(backend)
+        if composite and not composite_fits(dpi, encoding, pixel_budget, layout):
+            logger.warning("A whole sheet at this DPI is over the pixel budget, placing one image per page instead")
+            composite = False
+    composite = composite and rasterize
+
+    with timer.stage("open"):
+        pdf_reader = open_input(input_pdf)
+    try:
+        num_total_pages = len(pdf_reader)
+        if num_total_pages == 0:
+            raise ValueError("Input PDF has no pages")
+
+        page_order = range(num_total_pages)
+        if page_range is not None:
+            page_order = parse_ranges(page_range, num_total_pages)
+
+        duplicates = None
+        if skip_blank:
+            # Every selected page has to be checked: the blank ones shift what lands on later sheets
+            from .dedup import find_duplicates
+            with timer.stage("fingerprint"):
+                duplicates = find_duplicates(pdf_reader, raster_check, page_order)
+            page_order = [page_num for page_num in page_order if page_num not in duplicates.blank]
+            if not page_order:
+                raise ValueError("Input PDF has only blank pages")
+
+        sheet_indices = None
+        if sheet_range is not None:
+            sheet_indices = parse_ranges(sheet_range, sheet_count(layout, len(page_order)))
+        with timer.stage("plan"):
+            plan = ImpositionPlan(layout, page_order, page_size_reader(pdf_reader), sheet_indices)
+
+        if dedup and duplicates is None:
+            # Only the pages on the planned sheets are compared
+            from .dedup import find_duplicates
+            with timer.stage("fingerprint"):
+                duplicates = find_duplicates(pdf_reader, raster_check, sorted({page_num for sheet_index in plan.sheet_indices for page_num in plan.page_numbers(sheet_index)}))
+        if duplicates is not None:
+            logger.info(f"{len(duplicates.canonical)} repeated and {len(duplicates.blank)} blank pages found")
+        if not dedup:
+            duplicates = None
+
+        # The sheets this run produces, in order; all of them unless a sheet range was given
+        num_sheets = len(plan)
+
+        images = None
+        if rasterize and duplicates is not None:
+            from .dedup import ImageStore
+            images = ImageStore(duplicates, raster_check)
+
+        digest = None
+        if (rasterize and cache is not None) or checkpoint_dir is not None:
+            with timer.stage("digest"):
+                digest = input_digest(input_pdf)
+
+        page_cache = None
+        if rasterize and cache is not None:
+            # Renders from different backends are not interchangeable
+            page_cache = cache.for_document(digest if backend == "fitz" else hashlib.sha256(f"{digest}:{backend}".encode()).hexdigest())
+
+        checkpoint = None
+        pending = list(plan.sheet_indices)
+        if checkpoint_dir is not None:
+            from .checkpoint import Checkpoint
+            settings = {"layout": list(layout), "rasterize": rasterize}
+            if rasterize:
+                # Banded pages are encoded differently, so the budget decides what a sheet looks like too
+                settings.update(backend=backend, dpi=dpi, text_layer=text_layer, encoding=list(encoding), pixel_budget=pixel_budget, passthrough=passthrough, composite=composite)
+            if skip_blank:
+                settings.update(skip_blank=True, raster_check=raster_check)
+            if page_range is not None:
+                # Sheet numbers count from the first selected page
+                settings.update(page_range=page_range)
+            checkpoint = Checkpoint(checkpoint_dir, digest, settings)
+            pending = [sheet_index for sheet_index in pending if not checkpoint.has(sheet_index)]
+            if len(pending) < num_sheets:
+                logger.info(f"Resuming from checkpoint: {num_sheets - len(pending)} of {num_sheets} sheets already done")
+                yield num_sheets - len(pending), num_sheets
+
+        text_index = None
+        if rasterize and text_layer and pending and (workers == 1 or len(pending) == 1):
+            from .text import build_text_index
+            with timer.stage("text"):
+                text_index = build_text_index(pdf_reader, [page_num for sheet_index in pending for page_num in plan.page_numbers(sheet_index)])
+
+        # Worker processes already overlap everything; composite sheets are one image, nothing to overlap
+        pipelined = pipeline > 0 and rasterize and not composite and not (workers > 1 and len(pending) > 1)
+        # Only one thread may use MuPDF at a time once the pipeline runs
+        fitz_lock = threading.Lock() if pipelined else contextlib.nullcontext()
+
+        def open_output():
+            if streaming:
+                from .writer import StreamingPdfWriter
+                if pipelined:
+                    from .pipeline import DEFAULT_QUEUE_SIZE
+                    return StreamingPdfWriter(output_pdf, DEFAULT_QUEUE_SIZE)
+                return StreamingPdfWriter(output_pdf)
+            return fitz.open()
+
+        def render_sheets(direct_doc=None):
+            # Yields (sheet_indices, doc) with one rendered page in doc per sheet index; serial sheets
+            # are built straight into direct_doc when one is given
+            if workers > 1 and len(pending) > 1:
+                from .parallel import iter_parallel_sheets
+                position = 0
+                chunks = iter_parallel_sheets(input_pdf, [plan.sheet(sheet_index) for sheet_index in pending], workers, dpi, rasterize, page_cache=page_cache,
+                                              timer=timer, text_layer=text_layer, encoding=encoding, pixel_budget=pixel_budget, duplicates=duplicates,
+                                              raster_check=raster_check, backend=backend, passthrough=passthrough, composite=composite)
+                for _, ready in chunks:
+                    for data in ready:
+                        chunk_doc = fitz.open(stream=data, filetype="pdf")
+                        # The consumer closes chunk_doc before asking for the next one
+                        count = len(chunk_doc)
+                        yield pending[position:position + count], chunk_doc
+                        position += count
+                return
+            if pipelined:
+                from .pipeline import RasterPipeline
+                stages = RasterPipeline(pdf_reader, [(sheet_index, plan.sheet(sheet_index)) for sheet_index in pending], dpi, fitz_lock, page_cache, timer, text_index, encoding, pixel_budget, images, renderer, passthrough, pipeline)
+                for sheet_index, sheet_doc in stages.iter_sheets(direct_doc):
+                    yield [sheet_index], sheet_doc
+                return
+            for sheet_index in pending:
+                timer.start_sheet(sheet_index)
+                sheet_doc = fitz.open() if direct_doc is None else direct_doc
+                if composite:
+                    create_composite_page(sheet_doc, pdf_reader, plan.sheet(sheet_index), dpi, page_cache, timer, text_index, encoding, renderer)
+                elif rasterize:
+                    create_raster_page(sheet_doc, pdf_reader, plan.sheet(sheet_index), dpi, page_cache, timer, text_index, encoding, pixel_budget, images, renderer, passthrough)
+                else:
+                    create_vector_page(sheet_doc, pdf_reader, plan.sheet(sheet_index), timer, duplicates)
+                timer.end_sheet()
+                yield [sheet_index], sheet_doc
+
+        sheets_done = num_sheets - len(pending)
+        output_started = False
+        try:
+            if checkpoint is None:
+                output = open_output()
+                # The streaming writer creates output_pdf right away
+                output_started = streaming
+                with output:
+                    # In streaming mode every sheet gets its own short-lived document
+                    for sheet_indices, doc in render_sheets(None if streaming else output):
+                        if doc is not output:
+                            with fitz_lock, timer.stage("write" if streaming else "merge"):
+                                output.insert_pdf(doc)
+                                doc.close()
+                        sheets_done += len(sheet_indices)
+                        yield sheets_done, num_sheets
+                    if not streaming:
+                        # garbage=4 also merges identical streams, so the fonts and images every
+                        # worker chunk brought its own copy of are written once
+                        output_started = True
+                        with timer.stage("write"):
+                            output.save(output_pdf, garbage=4, deflate=True)
+                if streaming and output.write_queue is not None:
+                    timer.add_queue("write", output.write_queue.metrics())
+            else:
+                for sheet_indices, doc in render_sheets():
+                    with fitz_lock, timer.stage("checkpoint"):
+                        checkpoint.save(sheet_indices, doc)
+                        doc.close()
+                    sheets_done += len(sheet_indices)
+                    yield sheets_done, num_sheets
+
+                # Every sheet is on disk now, whichever run rendered it
+                output = open_output()
+                output_started = streaming
+                with output:
+                    with timer.stage("write" if streaming else "merge"):
+                        for sheet_index in plan.sheet_indices:
+                            with checkpoint.open_sheet(sheet_index) as sheet_doc:
+                                output.insert_pdf(sheet_doc)
+                    if not streaming:
+                        # Every checkpoint sheet embeds its own fonts and images; garbage=4 merges the copies
+                        output_started = True
+                        with timer.stage("write"):
+                            output.save(output_pdf, garbage=4, deflate=True)
+                if streaming and output.write_queue is not None:
+                    timer.add_queue("write", output.write_queue.metrics())
+        except BaseException:
+            # Failed or cancelled: a half-written output is removed rather than left looking usable.
+            # Finished checkpoint sheets stay where they are for the next run.
+            if output_started and os.path.exists(output_pdf):
+                os.remove(output_pdf)
+            raise
+        if checkpoint is not None:
+            checkpoint.clear()
+        timer.add_bytes("write", os.path.getsize(output_pdf))
+        if timer is not NULL_TIMER:
+            logger.info("Stage timings:\n" + timer.format_summary())
+        logger.info(f"PDF reformatted successfully. Output: {output_pdf}")
+    finally:
+        pdf_reader.close()
+
+class Cancelled(Exception):
+    pass
+
+def reformat_pdf(input_pdf, output_pdf, num_pages=2, separate_with_line=False, dpi=150, maintain_aspect_ratio=True, rasterize=False, workers=1, streaming=False, cache=None, timer=NULL_TIMER, text_layer=False, encoding=None, pixel_budget=DEFAULT_PIXEL_BUDGET, checkpoint_dir=None, dedup=False, skip_blank=False, raster_check=False, backend=None, passthrough=False, composite=False, pipeline=0, layout=None, page_range=None, sheet_range=None, progress=None, cancel=None):
+    # progress, if given, is called with the percentage of sheets completed
+    # cancel, if given, is a threading.Event; once it is set the job stops after the current sheet,
+    # any partial output is removed and Cancelled is raised
+    sheets = iter_reformat_pdf(input_pdf, output_pdf, num_pages=num_pages, separate_with_line=separate_with_line, dpi=dpi,
+                               maintain_aspect_ratio=maintain_aspect_ratio, rasterize=rasterize, workers=workers, streaming=streaming, cache=cache,
+                               timer=timer, text_layer=text_layer, encoding=encoding, pixel_budget=pixel_budget, checkpoint_dir=checkpoint_dir,
+                               dedup=dedup, skip_blank=skip_blank, raster_check=raster_check, backend=backend, passthrough=passthrough,
+                               composite=composite, pipeline=pipeline, layout=layout, page_range=page_range, sheet_range=sheet_range)
+    with contextlib.closing(sheets):
+        for sheets_done, num_sheets in sheets:
+            if progress is not None:
+                progress(sheets_done / num_sheets * 100)
+            if cancel is not None and cancel.is_set():
+                raise Cancelled("Cancelled")
@@ -0,0 +1,171 @@
+from array import array
+from collections import namedtuple
+import fitz  # PyMuPDF
+from .batch import locate_page
+from .vector import SHEET_RECT, fit_to_slot
+
+ORDERS = ("sequential", "booklet")
+
+# How pages are laid out on a sheet: a grid of rows x cols slots filled left to right, top to bottom,
+# on a sheet_width x sheet_height sheet (points) with margin around the grid and gutter between slots.
+# order "booklet" puts two pages on each side of a saddle-stitched booklet: printed double-sided,
+# folded in the middle and stapled, the pages read in order.
+Layout = namedtuple("Layout", ["rows", "cols", "sheet_width", "sheet_height", "margin", "gutter", "order", "maintain_aspect_ratio", "separate_with_line"],
+                    defaults=[1, 2, SHEET_RECT.width, SHEET_RECT.height, 0.0, 0.0, "sequential", True, False])
+
+# One sheet of a plan, in points from the top-left corner of the sheet: slots holds (page_num, rect)
+# for every filled slot in slot order, lines the separators as (x0, y0, x1, y1). Plain tuples, so
+# it pickles cheaply for worker processes.
+SheetLayout = namedtuple("SheetLayout", ["width", "height", "slots", "lines"])
+
+EMPTY = -1
+
+MM = 72 / 25.4
+
+def parse_sheet_size(text):
+    # (width, height) in points from a paper name fitz knows ("a4", "a3-l", "letter-l") or from
+    # WIDTHxHEIGHT in millimetres ("320x450")
+    if "x" in text.lower():
+        try:
+            width, height = (float(part) * MM for part in text.lower().split("x"))
+        except ValueError:
+            raise ValueError(f"Bad sheet size {text!r}, expected a paper name or WIDTHxHEIGHT in mm")
+        return width, height
+    rect = fitz.paper_rect(text.lower())
+    if rect.width <= 0:
+        raise ValueError(f"Unknown paper size {text!r}")
+    return rect.width, rect.height
+
+def check_layout(layout):
+    if layout.rows <= 0 or layout.cols <= 0:
+        raise ValueError("Rows and columns must be positive")
+    if layout.sheet_width <= 0 or layout.sheet_height <= 0:
+        raise ValueError("Sheet size must be positive")
+    if layout.margin < 0 or layout.gutter < 0:
+        raise ValueError("Margin and gutter cannot be negative")
+    if layout.order not in ORDERS:
+        raise ValueError(f"Unknown page order {layout.order!r}, expected one of: {', '.join(ORDERS)}")
+    if layout.order == "booklet" and layout.rows * layout.cols != 2:
+        raise ValueError("A booklet has two pages per sheet side")
+    if cell_size(layout, layout.cols)[0] <= 0 or cell_size(layout, layout.cols)[1] <= 0:
+        raise ValueError("Margins and gutters leave no room for the pages")
+
+def sheet_count(layout, num_pages):
+    # How many sheets impose_order makes of num_pages pages, without making them
+    if layout.order == "booklet":
+        return -(-num_pages // 4) * 2
+    return -(-num_pages // (layout.rows * layout.cols))
+
+def impose_order(layout, page_order):
+    # The page numbers on each output sheet (one side of paper), EMPTY for a slot left blank
+    slots = layout.rows * layout.cols
+    page_order = list(page_order)
+    if layout.order == "booklet":
+        # Padded to whole folded sheets; sheet k has the outermost pages left on its front and the
+        # next two inner ones on its back
+        count = -(-len(page_order) // 4) * 4
+        page_order += [EMPTY] * (count - len(page_order))
+        sides = []
+        for k in range(count // 4):
+            sides.append((page_order[count - 1 - 2 * k], page_order[2 * k]))
+            sides.append((page_order[2 * k + 1], page_order[count - 2 - 2 * k]))
+        return sides
+    return [tuple(page_order[i:i + slots]) for i in range(0, len(page_order), slots)]
+
+def cell_size(layout, cols):
+    width = (layout.sheet_width - 2 * layout.margin - layout.gutter * (cols - 1)) / cols
+    height = (layout.sheet_height - 2 * layout.margin - layout.gutter * (layout.rows - 1)) / layout.rows
+    return width, height
+
+def cell_origins(layout, cols):
+    # Top-left corner of every slot, row by row
+    width, height = cell_size(layout, cols)
+    return [(layout.margin + col * (width + layout.gutter), layout.margin + row * (height + layout.gutter))
+            for row in range(layout.rows) for col in range(cols)]
+
+def separator_lines(layout, cols):
+    # Down the middle of every gutter between columns and rows, across the whole grid
+    if not layout.separate_with_line:
+        return ()
+    width, height = cell_size(layout, cols)
+    top, bottom = layout.margin, layout.sheet_height - layout.margin
+    left, right = layout.margin, layout.sheet_width - layout.margin
+    lines = []
+    for col in range(1, cols):
+        x = layout.margin + col * (width + layout.gutter) - layout.gutter / 2
+        lines.append((x, top, x, bottom))
+    for row in range(1, layout.rows):
+        y = layout.margin + row * (height + layout.gutter) - layout.gutter / 2
+        lines.append((left, y, right, y))
+    return tuple(lines)
+
+def page_size_reader(pdf_reader):
+    # Page sizes straight from the documents; a page is only loaded for its size, not its content
+    def page_size(page_num):
+        doc, local_num = locate_page(pdf_reader, page_num)
+        rect = doc[local_num].rect
+        return rect.width, rect.height
+    return page_size
+
+class ImpositionPlan:
+    # The placement of every page of a job, worked out once. pages holds the page number of each
+    # slot of each planned sheet and rects its target rectangle (x0, y0, x1, y1), both flat arrays
+    # indexed by sheet position * slots + slot. Pages are fitted to their slot and centred in it,
+    # bottom-aligned; the offset inside the slot only depends on the page size, so it is computed
+    # once per size class and reused for every page of that size.
+    # page_size(page_num) gives (width, height) of a source page. sheet_indices limits the plan to
+    # those sheets of impose_order; page sizes are only asked for the pages on them.
+    def __init__(self, layout, page_order, page_size, sheet_indices=None):
+        check_layout(layout)
+        self.layout = layout
+        self.slots = layout.rows * layout.cols
+        order = impose_order(layout, page_order)
+        self.num_sheets = len(order)
+        self.sheet_indices = array("i", range(self.num_sheets) if sheet_indices is None else sheet_indices)
+        self.positions = {sheet_index: position for position, sheet_index in enumerate(self.sheet_indices)}
+        self.pages = array("i", [EMPTY]) * (len(self.sheet_indices) * self.slots)
+        self.rects = array("d", [0.0]) * (len(self.sheet_indices) * self.slots * 4)
+        self.columns = array("i", [layout.cols]) * len(self.sheet_indices)
+
+        origins = {}
+        offsets = {}
+        for position, sheet_index in enumerate(self.sheet_indices):
+            sheet_pages = order[sheet_index]
+            cols = layout.cols
+            if layout.rows == 1 and layout.order == "sequential":
+                # A short last sheet spreads its pages over the whole row
+                cols = len(sheet_pages)
+            self.columns[position] = cols
+            if cols not in origins:
+                origins[cols] = cell_origins(layout, cols)
+            for slot, page_num in enumerate(sheet_pages):
+                if page_num == EMPTY:
+                    continue
+                width, height = page_size(page_num)
+                size_class = (cols, round(width, 2), round(height, 2))
+                offset = offsets.get(size_class)
+                if offset is None:
+                    cell_width, cell_height = cell_size(layout, cols)
+                    scaled_width, scaled_height = fit_to_slot(width, height, cell_width, cell_height, layout.maintain_aspect_ratio)
+                    left = (cell_width - scaled_width) / 2
+                    offset = offsets[size_class] = (left, cell_height - scaled_height, left + scaled_width, cell_height)
+                x, y = origins[cols][slot]
+                entry = position * self.slots + slot
+                self.pages[entry] = page_num
+                self.rects[entry * 4:entry * 4 + 4] = array("d", (x + offset[0], y + offset[1], x + offset[2], y + offset[3]))
+        self.size_classes = len(offsets)
+
+    def __len__(self):
+        return len(self.sheet_indices)
+
+    def sheet(self, sheet_index):
+        position = self.positions[sheet_index]
+        slots = []
+        for entry in range(position * self.slots, (position + 1) * self.slots):
+            if self.pages[entry] != EMPTY:
+                slots.append((self.pages[entry], tuple(self.rects[entry * 4:entry * 4 + 4])))
+        return SheetLayout(self.layout.sheet_width, self.layout.sheet_height, tuple(slots), separator_lines(self.layout, self.columns[position]))
+
+    def page_numbers(self, sheet_index):
+        position = self.positions[sheet_index]
+        return [page_num for page_num in self.pages[position * self.slots:(position + 1) * self.slots] if page_num != EMPTY]
@@ -0,0 +1,97 @@
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import fitz  # PyMuPDF
+from .backends import load_renderer
+from .batch import open_input
+from .timing import NULL_TIMER, StageTimer
+from .vector import create_vector_page
+
+# Each worker process opens the input (and its render cache) once and keeps it for all of its tasks
+_worker_reader = None
+_worker_cache = None
+
+def _open_input(input_pdf, page_cache):
+    global _worker_reader, _worker_cache
+    _worker_reader = open_input(input_pdf, readahead=0)
+    _worker_cache = page_cache
+
+def _render_chunk(chunk, dpi, rasterize, timed, text_layer, encoding, pixel_budget, duplicates, raster_check, backend, passthrough, composite):
+    images = None
+    renderer = None
+    if rasterize:
+        from .raster import create_composite_page, create_raster_page
+        renderer = load_renderer(backend)
+        if duplicates is not None:
+            from .dedup import ImageStore
+            images = ImageStore(duplicates, raster_check)
+
+    # Worker timings travel back with the chunk and are merged into the parent's timer
+    timer = StageTimer() if timed else NULL_TIMER
+    text_index = None
+    if rasterize and text_layer:
+        from .text import build_text_index
+        with timer.stage("text"):
+            text_index = build_text_index(_worker_reader, [page_num for sheet_layout in chunk for page_num, _ in sheet_layout.slots])
+
+    out_doc = fitz.open()
+    for sheet_layout in chunk:
+        if rasterize and composite:
+            create_composite_page(out_doc, _worker_reader, sheet_layout, dpi, _worker_cache, timer, text_index, encoding, renderer)
+        elif rasterize:
+            create_raster_page(out_doc, _worker_reader, sheet_layout, dpi, _worker_cache, timer, text_index, encoding, pixel_budget, images, renderer, passthrough)
+        else:
+            create_vector_page(out_doc, _worker_reader, sheet_layout, timer, duplicates)
+    with timer.stage("serialize"):
+        data = out_doc.tobytes(deflate=True)
+    timer.add_bytes("serialize", len(data))
+    out_doc.close()
+    return data, timer.totals if timed else None
+
+def default_chunk_size(num_sheets, workers):
+    # A few tasks per worker keeps the pool busy without flooding it with tiny jobs
+    return max(1, min(16, num_sheets // (workers * 4)))
+
+def iter_parallel_sheets(input_pdf, sheets, workers, dpi, rasterize, page_cache=None, timer=NULL_TIMER, text_layer=False, encoding=None, pixel_budget=None, duplicates=None, raster_check=False, backend="fitz", passthrough=False, composite=False, chunk_size=None):
+    # sheets is a list of imposition.SheetLayout.
+    # Yields (sheets_done, ready) where ready holds rendered chunks (PDF bytes) that can be appended in order
+    if chunk_size is None:
+        chunk_size = default_chunk_size(len(sheets), workers)
+    chunks = [sheets[i:i + chunk_size] for i in range(0, len(sheets), chunk_size)]
+
+    # Spawned workers do not inherit the parent's MuPDF state
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_open_input, initargs=(input_pdf, page_cache)) as executor:
+        # At most two chunks per worker are submitted but not yet handed on, counting finished ones
+        # waiting for an earlier chunk, and a future is dropped as soon as its result is taken, so
+        # memory does not grow with the length of the document
+        max_pending = 2 * workers
+        futures = {}
+        finished = {}
+        next_submit = 0
+        next_index = 0
+        sheets_done = 0
+        try:
+            while next_index < len(chunks):
+                while next_submit < len(chunks) and next_submit - next_index < max_pending:
+                    future = executor.submit(_render_chunk, chunks[next_submit], dpi=dpi, rasterize=rasterize, timed=timer is not NULL_TIMER, text_layer=text_layer,
+                                             encoding=encoding, pixel_budget=pixel_budget, duplicates=duplicates, raster_check=raster_check,
+                                             backend=backend, passthrough=passthrough, composite=composite)
+                    futures[future] = next_submit
+                    next_submit += 1
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures.pop(future)
+                    finished[index], totals = future.result()
+                    if totals is not None:
+                        timer.merge(totals)
+                    sheets_done += len(chunks[index])
+
+                ready = []
+                while next_index in finished:
+                    ready.append(finished.pop(next_index))
+                    next_index += 1
+                yield sheets_done, ready
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,101 @@
+import fitz  # PyMuPDF
+
+# Compressed forms that are kept exactly as the scanner wrote them
+PASSTHROUGH_FILTERS = ("DCTDecode", "CCITTFaxDecode")
+
+# Image dictionary entries carried over; anything else about the image is in its stream
+_IMAGE_KEYS = ("Width", "Height", "BitsPerComponent", "ColorSpace", "Decode")
+_STREAM_KEYS = ("Filter", "DecodeParms")
+
+def find_scanned_image(page):
+    # The xref of the single JPEG or CCITT image a scanned page consists of, or 0 when the page
+    # draws anything else (visible text, vector graphics, annotations, more images) and has to be
+    # rendered. An invisible OCR text layer does not count, it is never drawn.
+    if page.rotation or page.first_annot is not None:
+        return 0
+    images = page.get_images(full=True)
+    if len(images) != 1:
+        return 0
+    xref, smask, filter_name = images[0][0], images[0][1], images[0][8]
+    if smask or filter_name not in PASSTHROUGH_FILTERS:
+        return 0
+
+    placements = page.get_image_info(xrefs=True)
+    if len(placements) != 1 or placements[0]["xref"] != xref:
+        return 0
+    a, b, c, d, _, _ = placements[0]["transform"]
+    # Upright and unmirrored only; anything else would need the placement matrix reproduced
+    if abs(b) > 1e-3 or abs(c) > 1e-3 or a <= 0 or d <= 0:
+        return 0
+    bbox = fitz.Rect(placements[0]["bbox"])
+    rect = page.rect
+    if max(abs(bbox.x0 - rect.x0), abs(bbox.y0 - rect.y0), abs(bbox.x1 - rect.x1), abs(bbox.y1 - rect.y1)) > 1:
+        return 0
+
+    if page.get_drawings():
+        return 0
+    if any(span["type"] != 3 for span in page.get_texttrace()):
+        return 0
+    return xref
+
+def copy_image_xobject(out_doc, src_doc, xref):
+    # Copies the image stream byte for byte into out_doc and returns its new xref, or None when
+    # the image uses something that cannot be carried over this simply (an image mask, indirect
+    # parameters, a colour space other than a device one or an ICC profile)
+    kind, value = src_doc.xref_get_key(xref, "ImageMask")
+    if kind == "bool" and value == "true":
+        return None
+
+    entries = []
+    for key in _IMAGE_KEYS:
+        kind, value = src_doc.xref_get_key(xref, key)
+        if kind == "null":
+            if key == "Decode":
+                continue
+            return None
+        if key == "ColorSpace":
+            value = _copy_colorspace(out_doc, src_doc, kind, value)
+            if value is None:
+                return None
+        elif " R" in value:
+            return None
+        entries.append(f"/{key} {value}")
+
+    stream_entries = []
+    for key in _STREAM_KEYS:
+        kind, value = src_doc.xref_get_key(xref, key)
+        if kind == "null":
+            continue
+        if " R" in value:
+            return None
+        stream_entries.append((key, value))
+
+    new_xref = out_doc.get_new_xref()
+    out_doc.update_object(new_xref, "<</Type/XObject/Subtype/Image" + "".join(entries) + ">>")
+    out_doc.update_stream(new_xref, src_doc.xref_stream_raw(xref), new=True, compress=False)
+    for key, value in stream_entries:
+        out_doc.xref_set_key(new_xref, key, value)
+    return new_xref
+
+def _copy_colorspace(out_doc, src_doc, kind, value):
+    if kind == "xref":
+        # A colour space of its own object, the way PyMuPDF and many scanners store an ICC space
+        value = src_doc.xref_object(int(value.split()[0]), compressed=True).strip()
+        kind = "array" if value.startswith("[") else "name" if value.startswith("/") else None
+    if kind == "name":
+        return value if value in ("/DeviceGray", "/DeviceRGB", "/DeviceCMYK") else None
+    # [/ICCBased n 0 R] is common in scanner output; the profile stream comes along
+    parts = value.strip("[]").split()
+    if kind != "array" or len(parts) != 4 or parts[0] != "/ICCBased":
+        return None
+    icc_xref = int(parts[1])
+    n_kind, n_value = src_doc.xref_get_key(icc_xref, "N")
+    filter_kind, filter_value = src_doc.xref_get_key(icc_xref, "Filter")
+    if n_kind != "int" or " R" in filter_value:
+        return None
+    new_icc = out_doc.get_new_xref()
+    out_doc.update_object(new_icc, f"<</N {n_value}>>")
+    out_doc.update_stream(new_icc, src_doc.xref_stream_raw(icc_xref), new=True, compress=False)
+    if filter_kind != "null":
+        out_doc.xref_set_key(new_icc, "Filter", filter_value)
+    return f"[/ICCBased {new_icc} 0 R]"
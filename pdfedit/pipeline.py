@@ -0,0 +1,187 @@
+import threading
+from collections import namedtuple
+import fitz  # PyMuPDF
+from .encoding import DEFAULT_ENCODING, add_image_xobject, encode_image
+from .raster import add_page_image, finish_raster_page, plan_render, render_banded, render_page
+from .timing import NULL_TIMER, StageQueue, StageTimer
+
+# Items waiting between two stages. Together with the pages the threads are working on, this is how
+# many rendered pages can be in memory at once.
+DEFAULT_QUEUE_SIZE = 4
+
+# One page of a sheet on its way through the stages. kind is "image" (payload is a render still to be
+# encoded), "encoded" (an encoding.EncodedImage), "scan" (payload is (document, xref) of a scanned
+# image placed as it is) or "reuse" (the image stored under keys[0] for an earlier page).
+SlotJob = namedtuple("SlotJob", ["sheet_index", "slot", "page_num", "target", "kind", "payload", "keys"])
+
+_DONE = None
+
+class RasterPipeline:
+    # Builds raster sheets in stages connected by bounded timing.StageQueues, so rendering the next
+    # pages overlaps with compressing and placing the earlier ones:
+    #   render    one thread loads and renders the source pages
+    #   encode    encode_threads threads compress the renders (zlib and libjpeg release the GIL)
+    #   assemble  the caller's thread puts the images on the sheets and hands them on in order
+    # MuPDF is not thread-safe, so render and assemble take turns on fitz_lock. The caller holds the
+    # same lock while it does anything else with fitz (merging, writing, checkpointing sheets).
+    # sheets is a list of (sheet_index, imposition.SheetLayout).
+    def __init__(self, pdf_reader, sheets, dpi, fitz_lock, page_cache=None, timer=NULL_TIMER, text_index=None, encoding=DEFAULT_ENCODING, pixel_budget=None, images=None, renderer=None, passthrough=False, encode_threads=2, queue_size=DEFAULT_QUEUE_SIZE):
+        self.pdf_reader = pdf_reader
+        self.sheets = sheets
+        self.dpi = dpi
+        self.fitz_lock = fitz_lock
+        self.page_cache = page_cache
+        self.timer = timer
+        self.text_index = text_index
+        self.encoding = encoding
+        self.pixel_budget = pixel_budget
+        self.images = images
+        self.renderer = renderer
+        self.passthrough = passthrough
+        self.encode_threads = encode_threads
+        self.stop = threading.Event()
+        self.encode_queue = StageQueue(queue_size, self.stop)
+        self.assemble_queue = StageQueue(queue_size, self.stop)
+        self.error = None
+
+    def iter_sheets(self, direct_doc=None):
+        # Yields (sheet_index, doc) in the order of sheets, each built in a new document or in direct_doc
+        # Stage timers are per thread, StageTimer is not meant to be shared; they are merged at the end
+        timed = self.timer is not NULL_TIMER
+        stage_timers = []
+        threads = []
+        for target, count in ((self._render, 1), (self._encode, self.encode_threads)):
+            for _ in range(count):
+                timer = StageTimer() if timed else NULL_TIMER
+                stage_timers.append(timer)
+                threads.append(threading.Thread(target=self._run_stage, args=(target, timer), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        waiting = {}
+        try:
+            for sheet_index, sheet_layout in self.sheets:
+                while len(waiting.get(sheet_index, ())) < len(sheet_layout.slots):
+                    job = self._next_job()
+                    if job is not _DONE:
+                        waiting.setdefault(job.sheet_index, []).append(job)
+                jobs = sorted(waiting.pop(sheet_index, ()), key=lambda job: job.slot)
+
+                self.timer.start_sheet(sheet_index)
+                with self.fitz_lock:
+                    sheet_doc = fitz.open() if direct_doc is None else direct_doc
+                    self._assemble(sheet_doc, sheet_layout, jobs)
+                self.timer.end_sheet()
+                yield sheet_index, sheet_doc
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+            if timed:
+                for timer in stage_timers:
+                    self.timer.merge(timer.totals)
+            self.timer.add_queue("encode", self.encode_queue.metrics())
+            self.timer.add_queue("assemble", self.assemble_queue.metrics())
+
+    def _run_stage(self, target, timer):
+        try:
+            target(timer)
+        except StageQueue.Stopped:
+            pass
+        except BaseException as e:
+            # The first failure stops every stage and is raised on the caller's thread
+            if self.error is None:
+                self.error = e
+            self.stop.set()
+
+    def _next_job(self):
+        try:
+            return self.assemble_queue.get()
+        except StageQueue.Stopped:
+            raise self.error or RuntimeError("pipeline stopped")
+
+    def _render(self, timer):
+        gray = self.encoding.color_mode in ("gray", "bilevel")
+        # Pages already sent on, by image key, with the scan for pages placed as one; a repeat only
+        # needs a reference to the first one
+        sent = {}
+        for sheet_index, sheet_layout in self.sheets:
+            for slot, (page_num, rect) in enumerate(sheet_layout.slots):
+                target = fitz.Rect(rect)
+                with self.fitz_lock:
+                    source_num = self.images.source_page(page_num) if self.images is not None else page_num
+                    with timer.stage("load"):
+                        page = self.pdf_reader.load_page(source_num)
+                    matrix, pixel_size = plan_render(page.rect, target, self.dpi)
+                    job = SlotJob(sheet_index, slot, page_num, target, None, None, [])
+
+                    if self.images is not None:
+                        key = (source_num, pixel_size)
+                        job = job._replace(keys=[key])
+                        if key in sent:
+                            job = job._replace(kind="reuse" if sent[key] is None else "scan", payload=sent[key])
+                    if job.kind is None and self.passthrough:
+                        from .passthrough import find_scanned_image
+                        with timer.stage("passthrough"):
+                            scan_xref = find_scanned_image(page)
+                        if scan_xref:
+                            job = job._replace(kind="scan", payload=(page.parent, scan_xref))
+                    if job.kind is None:
+                        if self.pixel_budget is not None and pixel_size[0] * pixel_size[1] * (1 if gray else 3) > self.pixel_budget:
+                            job = job._replace(kind="encoded", payload=render_banded(page, matrix, pixel_size, self.pixel_budget, self.encoding, timer))
+                        else:
+                            job = job._replace(kind="image", payload=render_page(page, source_num, matrix, pixel_size, self.page_cache, timer, gray, self.renderer))
+                    if self.images is not None:
+                        sent.setdefault(job.keys[0], job.payload if job.kind == "scan" else None)
+                    # Pages are freed under the lock as well
+                    del page
+                self.encode_queue.put(job)
+        for _ in range(self.encode_threads):
+            self.encode_queue.put(_DONE)
+
+    def _encode(self, timer):
+        while True:
+            job = self.encode_queue.get()
+            if job is _DONE:
+                self.assemble_queue.put(_DONE)
+                return
+            if job.kind == "image":
+                keys = job.keys
+                if self.images is not None and self.images.raster_hash:
+                    from .dedup import pixel_key
+                    keys = keys + [pixel_key(job.payload)]
+                with timer.stage("encode"):
+                    encoded = encode_image(job.payload, self.encoding)
+                job = job._replace(kind="encoded", payload=encoded, keys=keys)
+            self.assemble_queue.put(job)
+
+    def _assemble(self, sheet_doc, sheet_layout, jobs):
+        sheet = sheet_doc.new_page(width=sheet_layout.width, height=sheet_layout.height)
+        placements = []
+        for job in jobs:
+            xref = None
+            if self.images is not None:
+                # A pixel match found by the encode stage wins over storing the new encoding
+                xref = self.images.get(sheet_doc, job.keys[-1])
+            if xref is None and job.kind == "scan":
+                from .passthrough import copy_image_xobject
+                with self.timer.stage("passthrough"):
+                    xref = copy_image_xobject(sheet_doc, *job.payload)
+                if xref is not None and self.images is not None:
+                    self.images.put(sheet_doc, job.keys, None, xref)
+            elif xref is None and job.kind == "encoded":
+                self.timer.add_bytes("encode", len(job.payload.data))
+                xref = add_image_xobject(sheet_doc, job.payload)
+                if self.images is not None:
+                    self.images.put(sheet_doc, job.keys, job.payload, xref)
+
+            if xref is None:
+                # A scan that cannot be copied as it is, or a repeat whose image is gone with an earlier
+                # document: rendered here like on the serial path
+                target = add_page_image(sheet, self.pdf_reader, job.page_num, job.target, self.dpi, self.page_cache, self.timer, self.encoding, self.pixel_budget, self.images, self.renderer)
+            else:
+                target = job.target
+                with self.timer.stage("draw"):
+                    sheet.insert_image(target, xref=xref, keep_proportion=False)
+            placements.append((job.page_num, target))
+        finish_raster_page(sheet, sheet_layout, self.text_index, placements, self.timer)
@@ -0,0 +1,179 @@
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw
+from .imposition import ImpositionPlan, Layout, page_size_reader
+
+logger = logging.getLogger(__name__)
+
+# Long edge in pixels of the quick first thumbnails and of the refined ones
+THUMBNAIL_SIZES = (96, 384)
+
+class ThumbnailCache:
+    # Page thumbnails keyed by (page number, long edge); the least recently used go once the
+    # cache holds more than limit bytes. Layout changes only recompose what is already here.
+    def __init__(self, limit=64 * 1024 * 1024):
+        self.limit = limit
+        self.images = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, page_num, size):
+        with self.lock:
+            image = self.images.get((page_num, size))
+            if image is not None:
+                self.images.move_to_end((page_num, size))
+            return image
+
+    def best(self, page_num):
+        # The largest thumbnail there is of the page, or None
+        for size in reversed(THUMBNAIL_SIZES):
+            image = self.get(page_num, size)
+            if image is not None:
+                return image
+        return None
+
+    def put(self, page_num, size, image):
+        nbytes = image.width * image.height * 3
+        with self.lock:
+            if (page_num, size) in self.images:
+                return
+            self.images[(page_num, size)] = image
+            self.size += nbytes
+            while self.size > self.limit:
+                _, old = self.images.popitem(last=False)
+                self.size -= old.width * old.height * 3
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.size = 0
+
+def render_thumbnail(page, size):
+    zoom = size / max(page.rect.width, page.rect.height)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+def compose_sheet(cache, sheet_layout, width):
+    # The imposition.SheetLayout of a real sheet, scaled down to width pixels
+    scale = width / sheet_layout.width
+    sheet = Image.new("RGB", (width, round(sheet_layout.height * scale)), "white")
+    for page_num, (x0, y0, x1, y1) in sheet_layout.slots:
+        thumbnail = cache.best(page_num)
+        if thumbnail is None:
+            continue
+        size = (max(1, round((x1 - x0) * scale)), max(1, round((y1 - y0) * scale)))
+        sheet.paste(thumbnail.resize(size, Image.BILINEAR), (round(x0 * scale), round(y0 * scale)))
+
+    if sheet_layout.lines:
+        draw = ImageDraw.Draw(sheet)
+        for x0, y0, x1, y1 in sheet_layout.lines:
+            draw.line([(round(x0 * scale), round(y0 * scale)), (round(x1 * scale), round(y1 * scale))], fill="black")
+    return sheet
+
+class PreviewRenderer:
+    # Renders the first few sheets on a background thread. A request is answered at once from small
+    # thumbnails, then again once larger ones are rendered; a newer request cuts the refinement of an
+    # older one short. The sheet images are handed to on_ready(images) on the Tk thread.
+    def __init__(self, root, on_ready, num_sheets=3, sheet_width=260, interval_ms=50):
+        self.root = root
+        self.on_ready = on_ready
+        self.num_sheets = num_sheets
+        self.sheet_width = sheet_width
+        self.interval_ms = interval_ms
+        self.cache = ThumbnailCache()
+        self._requests = queue.Queue()
+        self._results = queue.Queue()
+        self._fitz_lock = threading.Lock()
+        self._doc = None
+        self._doc_key = None
+        threading.Thread(target=self._run, daemon=True).start()
+        root.after(interval_ms, self._poll)
+
+    def request(self, input_pdf, num_pages, separate_with_line, maintain_aspect_ratio):
+        self._requests.put((input_pdf, num_pages, separate_with_line, maintain_aspect_ratio))
+
+    def _next_request(self, block):
+        # Only the most recent request matters
+        try:
+            request = self._requests.get(block=block)
+        except queue.Empty:
+            return None
+        while True:
+            try:
+                request = self._requests.get_nowait()
+            except queue.Empty:
+                return request
+
+    def pause(self):
+        # Called on the Tk thread before a job starts using MuPDF; MuPDF is not thread-safe, so the
+        # preview thread finishes the thumbnail it is on and then waits until resume()
+        self._fitz_lock.acquire()
+
+    def resume(self):
+        self._fitz_lock.release()
+
+    def _run(self):
+        request = None
+        while True:
+            if request is None:
+                request = self._next_request(block=True)
+            try:
+                request = self._answer(request)
+            except Exception:
+                # A broken file or page must not take the preview down for the rest of the session
+                logger.exception("Preview failed")
+                with self._fitz_lock:
+                    self._close_document()
+                self._results.put([])
+                request = None
+
+    def _close_document(self):
+        if self._doc is not None:
+            self._doc.close()
+        self._doc, self._doc_key = None, None
+        self.cache.clear()
+
+    def _answer(self, request):
+        # Renders the sheets for request; returns a newer request that cut it short, or None.
+        # The document is only ever touched from this thread, and only while holding _fitz_lock.
+        input_pdf, num_pages, separate_with_line, maintain_aspect_ratio = request
+        key = (input_pdf, os.path.getmtime(input_pdf))
+        with self._fitz_lock:
+            if key != self._doc_key:
+                self._close_document()
+                self._doc = fitz.open(input_pdf)
+                self._doc_key = key
+            page_numbers = range(min(self.num_sheets * num_pages, len(self._doc)))
+            plan = ImpositionPlan(Layout(1, num_pages, maintain_aspect_ratio=maintain_aspect_ratio, separate_with_line=separate_with_line), page_numbers, page_size_reader(self._doc))
+
+        for level, size in enumerate(THUMBNAIL_SIZES):
+            rendered = False
+            for page_num in page_numbers:
+                if self.cache.get(page_num, size) is not None:
+                    continue
+                newer = self._next_request(block=False)
+                if newer is not None:
+                    return newer
+                with self._fitz_lock:
+                    thumbnail = render_thumbnail(self._doc.load_page(page_num), size)
+                self.cache.put(page_num, size, thumbnail)
+                rendered = True
+            if level == 0 or rendered:
+                self._results.put([compose_sheet(self.cache, plan.sheet(sheet_index), self.sheet_width)
+                                   for sheet_index in range(plan.num_sheets)])
+        return None
+
+    def _poll(self):
+        latest = None
+        while True:
+            try:
+                latest = self._results.get_nowait()
+            except queue.Empty:
+                break
+        if latest is not None:
+            self.on_ready(latest)
+        self.root.after(self.interval_ms, self._poll)
@@ -0,0 +1,210 @@
+import zlib
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw
+from .encoding import DEFAULT_ENCODING, EncodedImage, add_image_xobject, detect_color_mode, encode_image
+from .timing import NULL_TIMER
+from .vector import draw_separators
+
+def create_raster_page(out_doc, pdf_reader, sheet_layout, dpi, page_cache=None, timer=NULL_TIMER, text_index=None, encoding=DEFAULT_ENCODING, pixel_budget=None, images=None, renderer=None, passthrough=False):
+    # sheet_layout is an imposition.SheetLayout saying where each page goes
+    sheet = out_doc.new_page(width=sheet_layout.width, height=sheet_layout.height)
+
+    placements = []
+    for page_num, rect in sheet_layout.slots:
+        target = add_page_image(sheet, pdf_reader, page_num, fitz.Rect(rect), dpi, page_cache, timer, encoding, pixel_budget, images, renderer, passthrough)
+        placements.append((page_num, target))
+    finish_raster_page(sheet, sheet_layout, text_index, placements, timer)
+    return sheet
+
+def finish_raster_page(sheet, sheet_layout, text_index, placements, timer=NULL_TIMER):
+    # Separator lines and the invisible text layer, once every page image is on the sheet
+    draw_separators(sheet, sheet_layout.lines, timer)
+
+    if text_index is not None:
+        from .text import add_text_layer
+        with timer.stage("text"):
+            add_text_layer(sheet, text_index, placements)
+
+def create_composite_page(out_doc, pdf_reader, sheet_layout, dpi, page_cache=None, timer=NULL_TIMER, text_index=None, encoding=DEFAULT_ENCODING, renderer=None):
+    # The whole sheet as one image: every slot is rendered into a single buffer at the output DPI,
+    # separator lines included, and the buffer is encoded once. One XObject per sheet instead of one
+    # per page makes smaller files that viewers draw faster.
+    sheet = out_doc.new_page(width=sheet_layout.width, height=sheet_layout.height)
+    zoom = dpi / 72
+    gray = encoding.color_mode in ("gray", "bilevel")
+    buffer = Image.new("L" if gray else "RGB", (max(1, round(sheet_layout.width * zoom)), max(1, round(sheet_layout.height * zoom))), "white")
+
+    placements = []
+    for page_num, rect in sheet_layout.slots:
+        target = fitz.Rect(rect)
+        with timer.stage("load"):
+            page = pdf_reader.load_page(page_num)
+        matrix, pixel_size = plan_render(page.rect, target, dpi)
+        img = render_page(page, page_num, matrix, pixel_size, page_cache, timer, gray, renderer)
+        with timer.stage("compose"):
+            buffer.paste(img.convert(buffer.mode), (round(target.x0 * zoom), round(target.y0 * zoom)))
+        placements.append((page_num, target))
+
+    if sheet_layout.lines:
+        with timer.stage("compose"):
+            draw = ImageDraw.Draw(buffer)
+            line_width = max(1, round(zoom))
+            for x0, y0, x1, y1 in sheet_layout.lines:
+                draw.line([(round(x0 * zoom), round(y0 * zoom)), (round(x1 * zoom), round(y1 * zoom))], fill="black", width=line_width)
+
+    with timer.stage("encode"):
+        encoded = encode_image(buffer, encoding)
+    timer.add_bytes("encode", len(encoded.data))
+    with timer.stage("draw"):
+        xref = add_image_xobject(out_doc, encoded)
+        sheet.insert_image(sheet.rect, xref=xref, keep_proportion=False)
+
+    if text_index is not None:
+        from .text import add_text_layer
+        with timer.stage("text"):
+            add_text_layer(sheet, text_index, placements)
+    return sheet
+
+def composite_fits(dpi, encoding, pixel_budget, layout):
+    # Whether a whole-sheet buffer for an imposition.Layout stays within pixel_budget bytes
+    if pixel_budget is None:
+        return True
+    zoom = dpi / 72
+    channels = 1 if encoding.color_mode in ("gray", "bilevel") else 3
+    return round(layout.sheet_width * zoom) * round(layout.sheet_height * zoom) * channels <= pixel_budget
+
+def plan_render(page_rect, target, dpi):
+    # Size the pixmap for the rectangle it will fill at the requested output DPI, so it never needs resampling
+    zoom = dpi / 72
+    pixel_width = max(1, round(target.width * zoom))
+    pixel_height = max(1, round(target.height * zoom))
+    matrix = fitz.Matrix(pixel_width / page_rect.width, pixel_height / page_rect.height)
+    return matrix, (pixel_width, pixel_height)
+
+def render_page(page, page_num, matrix, pixel_size, page_cache=None, timer=NULL_TIMER, gray=False, renderer=None):
+    # renderer is an optional backends renderer drawing the page instead of MuPDF
+    img = None
+    if page_cache is not None:
+        with timer.stage("cache"):
+            img = page_cache.get(page_num, pixel_size)
+    if img is None:
+        if renderer is not None:
+            with timer.stage("render"):
+                img = renderer.render(page, pixel_size, gray)
+            timer.add_bytes("render", img.width * img.height * len(img.getbands()))
+        else:
+            # A page that will be stored as gray anyway is rendered with one channel instead of three
+            with timer.stage("render"):
+                pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY if gray else fitz.csRGB)
+            timer.add_bytes("render", len(pix.samples))
+            with timer.stage("convert"):
+                img = Image.frombytes("L" if gray else "RGB", [pix.width, pix.height], pix.samples)
+        # Gray renders are not cached, a later colour job could not use them
+        if page_cache is not None and not gray:
+            with timer.stage("cache"):
+                page_cache.put(page_num, img)
+    return img
+
+def add_page_image(sheet, pdf_reader, page_num, target, dpi, page_cache=None, timer=NULL_TIMER, encoding=DEFAULT_ENCODING, pixel_budget=None, images=None, renderer=None, passthrough=False):
+    # images is an optional dedup.ImageStore; a page seen before reuses the image made for it.
+    # With passthrough a page that is nothing but one scanned JPEG or CCITT image is placed with that
+    # image's own stream, at its own resolution, instead of being rendered and encoded again.
+    if images is not None:
+        page_num = images.source_page(page_num)
+    with timer.stage("load"):
+        page = pdf_reader.load_page(page_num)
+    matrix, pixel_size = plan_render(page.rect, target, dpi)
+
+    xref = None
+    keys = []
+    if images is not None:
+        keys.append((page_num, pixel_size))
+        xref = images.get(sheet.parent, keys[0])
+    if xref is None and passthrough:
+        from .passthrough import copy_image_xobject, find_scanned_image
+        with timer.stage("passthrough"):
+            scan_xref = find_scanned_image(page)
+            if scan_xref:
+                xref = copy_image_xobject(sheet.parent, page.parent, scan_xref)
+        if xref is not None and images is not None:
+            images.put(sheet.parent, keys, None, xref)
+    if xref is None:
+        encoded = None
+        gray = encoding.color_mode in ("gray", "bilevel")
+        if pixel_budget is not None and pixel_size[0] * pixel_size[1] * (1 if gray else 3) > pixel_budget:
+            encoded = render_banded(page, matrix, pixel_size, pixel_budget, encoding, timer)
+        else:
+            img = render_page(page, page_num, matrix, pixel_size, page_cache, timer, gray, renderer)
+            if images is not None and images.raster_hash:
+                from .dedup import pixel_key
+                keys.append(pixel_key(img))
+                xref = images.get(sheet.parent, keys[-1])
+            if xref is None:
+                with timer.stage("encode"):
+                    encoded = encode_image(img, encoding)
+        if encoded is not None:
+            timer.add_bytes("encode", len(encoded.data))
+            xref = add_image_xobject(sheet.parent, encoded)
+        if images is not None:
+            images.put(sheet.parent, keys, encoded, xref)
+
+    with timer.stage("draw"):
+        sheet.insert_image(target, xref=xref, keep_proportion=False)
+    return target
+
+def render_banded(page, matrix, pixel_size, pixel_budget, encoding=DEFAULT_ENCODING, timer=NULL_TIMER):
+    # Renders a page that would not fit in pixel_budget bytes as horizontal bands, so no more than
+    # one band is in memory at a time. Flate streams are compressed band by band at full size; a
+    # JPEG has to be encoded in one piece, so its output is scaled down until it fits the budget and
+    # every band is resampled straight into it.
+    color_mode = encoding.color_mode
+    if color_mode == "auto":
+        preview_zoom = 512 / max(pixel_size)
+        preview = page.get_pixmap(matrix=fitz.Matrix(matrix.a * preview_zoom, matrix.d * preview_zoom))
+        color_mode = detect_color_mode(Image.frombytes("RGB", [preview.width, preview.height], preview.samples))
+    gray = color_mode in ("gray", "bilevel")
+    channels = 1 if gray else 3
+
+    pixel_width, pixel_height = pixel_size
+    out_width, out_height = pixel_width, pixel_height
+    if encoding.codec == "jpeg" and color_mode != "bilevel":
+        shrink = min(1.0, (pixel_budget / (pixel_width * pixel_height * channels)) ** 0.5)
+        out_width, out_height = max(1, int(pixel_width * shrink)), max(1, int(pixel_height * shrink))
+        output = Image.new("L" if gray else "RGB", (out_width, out_height))
+        compressor = None
+    else:
+        compressor = zlib.compressobj(6)
+        chunks = []
+
+    rect = page.rect
+    band_rows = max(1, pixel_budget // (pixel_width * channels))
+    row = 0
+    while row < pixel_height:
+        rows = min(band_rows, pixel_height - row)
+        clip = fitz.Rect(rect.x0, rect.y0 + row / matrix.d, rect.x1, rect.y0 + (row + rows) / matrix.d)
+        with timer.stage("render"):
+            pix = page.get_pixmap(matrix=matrix, clip=clip, colorspace=fitz.csGRAY if gray else fitz.csRGB)
+        band = Image.frombytes("L" if gray else "RGB", [pix.width, pix.height], pix.samples)
+        del pix
+        if band.size != (pixel_width, rows):
+            # Rounding of the clip can be off by a pixel; keep the band grid exact
+            band = band.resize((pixel_width, rows), Image.BILINEAR)
+
+        with timer.stage("encode"):
+            if compressor is None:
+                top = round(row * out_height / pixel_height)
+                bottom = round((row + rows) * out_height / pixel_height)
+                if bottom > top:
+                    output.paste(band.resize((out_width, bottom - top), Image.LANCZOS), (0, top))
+            elif color_mode == "bilevel":
+                bits = band.point(lambda value: 255 if value >= 128 else 0).convert("1", dither=Image.Dither.NONE)
+                chunks.append(compressor.compress(bits.tobytes()))
+            else:
+                chunks.append(compressor.compress(band.tobytes()))
+        row += rows
+
+    if compressor is None:
+        return encode_image(output, encoding._replace(color_mode=color_mode))
+    chunks.append(compressor.flush())
+    colorspace = "DeviceGray" if gray else "DeviceRGB"
+    return EncodedImage(b"".join(chunks), pixel_width, pixel_height, colorspace, 1 if color_mode == "bilevel" else 8, "FlateDecode")
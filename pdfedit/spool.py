@@ -0,0 +1,292 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# How often a job is started in total when the worker running it dies (out of memory, a crash in a
+# library); the worker pool cannot tell which of the running jobs brought it down
+MAX_ATTEMPTS = 2
+
+# Settings a job may set through its sidecar file, and how to read them
+SETTING_TYPES = {
+    "num_pages": int,
+    "dpi": int,
+    "separate_with_line": bool,
+    "maintain_aspect_ratio": bool,
+    "rasterize": bool,
+    "backend": str,
+    "passthrough": bool,
+    "composite": bool,
+    "text_layer": bool,
+    "codec": str,
+    "jpeg_quality": int,
+    "color_mode": str,
+}
+
+# Naming convention tokens, e.g. "manual.4up.300dpi.lines.raster.pdf"
+_NAME_TOKENS = [
+    (re.compile(r"^(\d+)up$"), lambda m: {"num_pages": int(m.group(1))}),
+    (re.compile(r"^(\d+)dpi$"), lambda m: {"dpi": int(m.group(1))}),
+    (re.compile(r"^lines$"), lambda m: {"separate_with_line": True}),
+    (re.compile(r"^stretch$"), lambda m: {"maintain_aspect_ratio": False}),
+    (re.compile(r"^raster$"), lambda m: {"rasterize": True}),
+    (re.compile(r"^jpeg$"), lambda m: {"codec": "jpeg"}),
+    (re.compile(r"^(gray|bilevel|rgb)$"), lambda m: {"color_mode": m.group(1)}),
+]
+
+def _parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+def job_settings(input_pdf, defaults):
+    # Defaults, then tokens in the file name, then a "<name>.json" sidecar next to the PDF
+    settings = dict(defaults)
+    stem = os.path.basename(input_pdf)[:-len(".pdf")]
+    for token in stem.split(".")[1:]:
+        for pattern, parse in _NAME_TOKENS:
+            match = pattern.match(token.lower())
+            if match:
+                settings.update(parse(match))
+                break
+
+    sidecar = sidecar_path(input_pdf)
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            loaded = json.load(f)
+        name = os.path.basename(sidecar)
+        if not isinstance(loaded, dict):
+            raise ValueError(f"{name} must hold a JSON object of settings")
+        for key, value in loaded.items():
+            if key not in SETTING_TYPES:
+                raise ValueError(f"Unknown setting in {name}: {key}")
+            # null, lists and objects would get through str() and bool() as nonsense values
+            if isinstance(value, (list, dict)) or value is None:
+                raise ValueError(f"Bad value for {key} in {name}: {value!r}")
+            convert = _parse_bool if SETTING_TYPES[key] is bool else SETTING_TYPES[key]
+            try:
+                settings[key] = convert(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Bad value for {key} in {name}: {value!r}")
+    return settings
+
+def sidecar_path(input_pdf):
+    return input_pdf[:-len(".pdf")] + ".json"
+
+def _warm_up():
+    # Import the heavy libraries once per worker process instead of once per job
+    from . import engine  # noqa: F401
+    from . import raster  # noqa: F401
+    from . import text  # noqa: F401
+
+def run_job(input_pdf, output_pdf, settings):
+    import fitz  # PyMuPDF
+    from . import engine
+    from .encoding import ImageEncoding
+
+    settings = dict(settings)
+    encoding = ImageEncoding(settings.pop("codec", "flate"), settings.pop("jpeg_quality", 85), settings.pop("color_mode", "auto"))
+    with fitz.open(input_pdf) as doc:
+        num_total_pages = len(doc)
+
+    # Written under a hidden name and renamed into place, so consumers never see a partial file
+    partial = os.path.join(os.path.dirname(output_pdf), "." + os.path.basename(output_pdf) + ".partial")
+    try:
+        engine.reformat_pdf(input_pdf, partial, encoding=encoding, **settings)
+        os.replace(partial, output_pdf)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return num_total_pages
+
+class SpoolService:
+    def __init__(self, input_dir, output_dir, workers=2, poll_interval=2.0, defaults=None, metrics_path=None, metrics_interval=30.0):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.defaults = dict(defaults or {})
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+        self.processed_dir = os.path.join(input_dir, "processed")
+        self.failed_dir = os.path.join(input_dir, "failed")
+        for directory in (output_dir, self.processed_dir, self.failed_dir):
+            os.makedirs(directory, exist_ok=True)
+
+        self.queue = deque()
+        self.running = {}
+        self.seen = {}
+        self.known = set()
+        self.stop_event = threading.Event()
+        self.started = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.pages_done = 0
+        self.job_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.submitted = 0
+
+    def scan(self):
+        # A file is queued once its size and mtime stayed the same for one poll, so half-copied scans are skipped
+        for entry in os.scandir(self.input_dir):
+            if not entry.is_file() or not entry.name.lower().endswith(".pdf") or entry.path in self.known:
+                continue
+            stat = entry.stat()
+            signature = (stat.st_size, stat.st_mtime)
+            if self.seen.get(entry.path) == signature:
+                del self.seen[entry.path]
+                self.enqueue(entry.path)
+            else:
+                self.seen[entry.path] = signature
+
+    def enqueue(self, input_pdf):
+        self.known.add(input_pdf)
+        try:
+            settings = job_settings(input_pdf, self.defaults)
+        except (ValueError, OSError) as e:
+            self._finish(input_pdf, None, error=e)
+            return
+        output_pdf = os.path.join(self.output_dir, os.path.basename(input_pdf))
+        self.queue.append((input_pdf, output_pdf, settings, time.monotonic(), 1))
+
+    def _retry(self, job, error):
+        # A job that was running when a worker died goes back to the front of the queue, up to MAX_ATTEMPTS
+        input_pdf, output_pdf, settings, _, attempt = job
+        if attempt >= MAX_ATTEMPTS:
+            self._finish(input_pdf, None, error=RuntimeError(f"worker process died {attempt} times: {error}"))
+            return
+        logger.warning(f"Worker process died while running {input_pdf}, trying again")
+        self.queue.appendleft((input_pdf, output_pdf, settings, time.monotonic(), attempt + 1))
+
+    def _finish(self, input_pdf, started, error=None, pages=0):
+        target_dir = self.failed_dir if error is not None else self.processed_dir
+        for path in (input_pdf, sidecar_path(input_pdf)):
+            if os.path.exists(path):
+                shutil.move(path, os.path.join(target_dir, os.path.basename(path)))
+        self.known.discard(input_pdf)
+        if error is not None:
+            self.failed += 1
+            with open(os.path.join(self.failed_dir, os.path.basename(input_pdf) + ".error.txt"), "w") as f:
+                f.write(f"{error}\n")
+            logger.error(f"Job failed: {input_pdf}: {error}")
+        else:
+            self.completed += 1
+            self.pages_done += pages
+            self.job_seconds += time.monotonic() - started
+            logger.info(f"Job done: {input_pdf} ({pages} pages)")
+
+    def metrics(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            "queue_depth": len(self.queue),
+            "running": len(self.running),
+            "completed": self.completed,
+            "failed": self.failed,
+            "pages_done": self.pages_done,
+            "pages_per_second": self.pages_done / elapsed if elapsed else 0.0,
+            "jobs_per_hour": self.completed / elapsed * 3600 if elapsed else 0.0,
+            "mean_job_seconds": self.job_seconds / self.completed if self.completed else 0.0,
+            "mean_queue_wait_seconds": self.wait_seconds / self.submitted if self.submitted else 0.0,
+            "uptime_seconds": elapsed,
+        }
+
+    def _report(self):
+        metrics = self.metrics()
+        logger.info("Spool: " + ", ".join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}" for key, value in metrics.items()))
+        if self.metrics_path:
+            tmp_path = self.metrics_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(metrics, f)
+            os.replace(tmp_path, self.metrics_path)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_warm_up)
+
+    def _restart(self, executor):
+        # A dead worker breaks the whole pool; the service carries on with a new one
+        logger.warning("Worker pool broken, starting a new one")
+        executor.shutdown(wait=False)
+        return self._new_executor()
+
+    def run(self):
+        last_report = time.monotonic()
+        executor = self._new_executor()
+        try:
+            while not self.stop_event.is_set() or self.running:
+                if not self.stop_event.is_set():
+                    self.scan()
+                    while self.queue and len(self.running) < self.workers:
+                        job = self.queue.popleft()
+                        input_pdf, output_pdf, settings, queued, _ = job
+                        try:
+                            future = executor.submit(run_job, input_pdf, output_pdf, settings)
+                        except BrokenProcessPool:
+                            self.queue.appendleft(job)
+                            executor = self._restart(executor)
+                            break
+                        self.wait_seconds += time.monotonic() - queued
+                        self.submitted += 1
+                        self.running[future] = (job, time.monotonic(), executor)
+
+                broken = None
+                for future in [future for future in self.running if future.done()]:
+                    job, started, pool = self.running.pop(future)
+                    try:
+                        self._finish(job[0], started, pages=future.result())
+                    except BrokenProcessPool as e:
+                        broken = pool
+                        self._retry(job, e)
+                    except Exception as e:
+                        self._finish(job[0], started, error=e)
+                # Jobs of a pool that was already replaced can still come in late
+                if broken is executor:
+                    executor = self._restart(executor)
+
+                if time.monotonic() - last_report >= self.metrics_interval:
+                    self._report()
+                    last_report = time.monotonic()
+                self.stop_event.wait(self.poll_interval if not self.running else min(self.poll_interval, 0.2))
+        finally:
+            executor.shutdown(wait=True)
+        self._report()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pdfedit.spool", description="Watch a folder and reformat every PDF dropped into it.")
+    parser.add_argument("input_dir", help="folder to watch for PDF files")
+    parser.add_argument("output_dir", help="where reformatted PDFs are written")
+    parser.add_argument("-j", "--workers", type=int, default=2, help="number of jobs processed at once (default: 2)")
+    parser.add_argument("--poll", type=float, default=2.0, help="seconds between folder scans (default: 2)")
+    parser.add_argument("--metrics-file", help="keep the latest queue and throughput metrics in this JSON file")
+    parser.add_argument("--metrics-interval", type=float, default=30.0, help="seconds between metrics reports (default: 30)")
+    parser.add_argument("-n", "--pages", type=int, default=2, dest="num_pages", help="default number of pages per sheet (default: 2)")
+    parser.add_argument("--dpi", type=int, default=150, help="default raster resolution (default: 150)")
+    parser.add_argument("--separate-with-line", action="store_true", help="draw a line between pages by default")
+    parser.add_argument("--rasterize", action="store_true", help="rasterize pages by default")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    defaults = {"num_pages": args.num_pages, "dpi": args.dpi, "separate_with_line": args.separate_with_line, "rasterize": args.rasterize}
+    service = SpoolService(args.input_dir, args.output_dir, args.workers, args.poll, defaults, args.metrics_file, args.metrics_interval)
+    # Finish the running jobs on Ctrl+C or SIGTERM; files still waiting are picked up on the next start
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: service.stop())
+    service.run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
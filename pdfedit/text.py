@@ -0,0 +1,47 @@
+import fitz  # PyMuPDF
+
+_FONT = None
+
+def _font():
+    global _FONT
+    if _FONT is None:
+        _FONT = fitz.Font("helv")
+    return _FONT
+
+def build_text_index(pdf_reader, page_numbers=None):
+    # One pass over the open document: page number -> list of (x, y, fontsize, text) spans,
+    # with (x, y) the baseline origin in page coordinates
+    if page_numbers is None:
+        page_numbers = range(len(pdf_reader))
+    index = {}
+    for page_num in page_numbers:
+        page = pdf_reader.load_page(page_num)
+        spans = []
+        for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
+            for line in block.get("lines", ()):
+                for span in line["spans"]:
+                    if span["text"].strip():
+                        spans.append((span["origin"][0], span["origin"][1], span["size"], span["text"]))
+        if spans:
+            index[page_num] = (tuple(page.rect), spans)
+    return index
+
+def add_text_layer(sheet, text_index, placements):
+    # placements: (page_num, target fitz.Rect) for every source page drawn onto the sheet
+    writer = fitz.TextWriter(sheet.rect)
+    font = _font()
+    written = False
+    for page_num, target in placements:
+        if page_num not in text_index:
+            continue
+        source_rect, spans = text_index[page_num]
+        x0, y0, x1, y1 = source_rect
+        scale_x = target.width / (x1 - x0)
+        scale_y = target.height / (y1 - y0)
+        for x, y, size, text in spans:
+            point = fitz.Point(target.x0 + (x - x0) * scale_x, target.y0 + (y - y0) * scale_y)
+            writer.append(point, text, font=font, fontsize=max(size * scale_y, 1))
+            written = True
+    if written:
+        # Render mode 3 makes the text invisible but keeps it selectable and searchable
+        writer.write_text(sheet, render_mode=3)
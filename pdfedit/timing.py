@@ -0,0 +1,160 @@
+import json
+import queue
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+class StageTimer:
+    # Collects time and byte counts per pipeline stage, both for the whole job and for
+    # the sheet in progress. With trace_path every finished sheet is appended as one JSON
+    # line, followed by a "total" line when the timer is closed.
+
+    def __init__(self, trace_path=None):
+        self.totals = {}
+        self.sheet_stages = None
+        self.sheet_index = None
+        self.sheet_start = None
+        self.started = time.perf_counter()
+        self.queues = {}
+        self.trace = open(trace_path, "w") if trace_path else None
+
+    def _add(self, name, seconds=0.0, nbytes=0, calls=1):
+        for stages in (self.totals, self.sheet_stages):
+            if stages is None:
+                continue
+            entry = stages.setdefault(name, {"seconds": 0.0, "bytes": 0, "calls": 0})
+            entry["seconds"] += seconds
+            entry["bytes"] += nbytes
+            entry["calls"] += calls
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(name, seconds=time.perf_counter() - start)
+
+    def add_bytes(self, name, nbytes):
+        self._add(name, nbytes=nbytes, calls=0)
+
+    def merge(self, totals):
+        # Folds in the totals of a timer that ran elsewhere, such as in a worker process
+        for name, entry in totals.items():
+            self._add(name, entry["seconds"], entry["bytes"], entry["calls"])
+
+    def add_queue(self, name, metrics):
+        # Final metrics of a StageQueue between two pipeline stages
+        self.queues[name] = metrics
+
+    def start_sheet(self, index):
+        self.sheet_index = index
+        self.sheet_stages = {}
+        self.sheet_start = time.perf_counter()
+
+    def end_sheet(self):
+        if self.trace is not None and self.sheet_stages is not None:
+            self._emit({"event": "sheet", "sheet": self.sheet_index, "seconds": time.perf_counter() - self.sheet_start, "stages": self.sheet_stages})
+        self.sheet_stages = None
+        self.sheet_index = None
+
+    def summary(self):
+        summary = {"seconds": time.perf_counter() - self.started, "stages": self.totals}
+        if self.queues:
+            summary["queues"] = self.queues
+        return summary
+
+    def _emit(self, record):
+        self.trace.write(json.dumps(record) + "\n")
+        self.trace.flush()
+
+    def close(self):
+        if self.trace is not None:
+            self._emit(dict(event="total", **self.summary()))
+            self.trace.close()
+            self.trace = None
+
+    def format_summary(self):
+        lines = [f"{'stage':<10} {'seconds':>9} {'calls':>7} {'MB':>9}"]
+        for name, entry in sorted(self.totals.items(), key=lambda item: -item[1]["seconds"]):
+            lines.append(f"{name:<10} {entry['seconds']:>9.3f} {entry['calls']:>7} {entry['bytes'] / 1e6:>9.2f}")
+        if self.queues:
+            lines.append(f"{'queue':<10} {'items':>7} {'depth':>9} {'blocked s':>9} {'starved s':>9}")
+            for name, metrics in self.queues.items():
+                lines.append(f"{name:<10} {metrics['items']:>7} {metrics['max_depth']:>4}/{metrics['capacity']:<4} {metrics['put_wait']:>9.3f} {metrics['get_wait']:>9.3f}")
+        return "\n".join(lines)
+
+class NullTimer:
+    # Used when no timing was asked for, so the pipeline can always call the timer
+
+    def stage(self, name):
+        return nullcontext()
+
+    def add_bytes(self, name, nbytes):
+        pass
+
+    def merge(self, totals):
+        pass
+
+    def add_queue(self, name, metrics):
+        pass
+
+    def start_sheet(self, index):
+        pass
+
+    def end_sheet(self):
+        pass
+
+NULL_TIMER = NullTimer()
+
+class StageQueue:
+    # A bounded queue between two pipeline stages. A full queue blocks the stage feeding it, which
+    # is what keeps memory flat when a later stage is the slow one. Records how many items went
+    # through, the deepest it got, how long producers were held up (put_wait, the later stage is
+    # the bottleneck) and how long consumers sat idle (get_wait, the earlier one is).
+    # stop is a threading.Event that releases every blocked put and get once a pipeline is torn down.
+
+    class Stopped(Exception):
+        pass
+
+    def __init__(self, maxsize, stop):
+        self.queue = queue.Queue(maxsize)
+        self.stop = stop
+        self.lock = threading.Lock()
+        self.items = 0
+        self.max_depth = 0
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+
+    def put(self, item):
+        start = time.perf_counter()
+        while True:
+            if self.stop.is_set():
+                raise StageQueue.Stopped()
+            try:
+                self.queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        with self.lock:
+            self.put_wait += time.perf_counter() - start
+            self.items += 1
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def get(self):
+        start = time.perf_counter()
+        while True:
+            if self.stop.is_set():
+                raise StageQueue.Stopped()
+            try:
+                item = self.queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                pass
+        with self.lock:
+            self.get_wait += time.perf_counter() - start
+        return item
+
+    def metrics(self):
+        with self.lock:
+            return {"items": self.items, "capacity": self.queue.maxsize, "max_depth": self.max_depth, "put_wait": self.put_wait, "get_wait": self.get_wait}
@@ -0,0 +1,78 @@
+import queue
+import threading
+import time
+
+class ProgressChannel:
+    # Carries progress from a worker thread to the Tk main loop. The worker only puts messages on a
+    # queue and never touches a widget; the main loop drains the queue with after() at a fixed rate
+    # and passes on only the latest update, so a fast job cannot flood or freeze the window.
+    def __init__(self, root, on_update, on_finish, interval_ms=100):
+        self.root = root
+        self.on_update = on_update  # called as on_update(percent, pages_per_second, eta_seconds or None)
+        self.on_finish = on_finish  # called as on_finish(error), error is None on success
+        self.interval_ms = interval_ms
+        self.cancel_event = threading.Event()
+        self.total_pages = 0  # set by the worker once it knows, used for the pages/s figure
+        self._queue = queue.Queue()
+        self._started = None
+        self._thread = None
+
+    def start(self, target, *args):
+        # Runs target(*args, channel) on a worker thread
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, args=(target, args), daemon=True)
+        self._thread.start()
+        self.root.after(self.interval_ms, self._poll)
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def report(self, percent):
+        # Worker side; safe to call as often as the job likes
+        self._queue.put(("progress", percent))
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _run(self, target, args):
+        try:
+            target(*args, self)
+        except Exception as e:
+            self._queue.put(("finish", e))
+        else:
+            self._queue.put(("finish", None))
+
+    def _poll(self):
+        latest = None
+        finished = False
+        error = None
+        while True:
+            try:
+                kind, value = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                latest = value
+            else:
+                finished, error = True, value
+
+        if latest is not None:
+            self.on_update(latest, *self._rates(latest))
+        if finished:
+            self.on_finish(error)
+        else:
+            self.root.after(self.interval_ms, self._poll)
+
+    def _rates(self, percent):
+        elapsed = time.monotonic() - self._started
+        if percent <= 0 or elapsed <= 0:
+            return 0.0, None
+        pages_per_second = self.total_pages * percent / 100 / elapsed
+        return pages_per_second, elapsed * (100 - percent) / percent
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
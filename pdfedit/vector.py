@@ -0,0 +1,47 @@
+import fitz  # PyMuPDF
+from .batch import locate_page
+from .timing import NULL_TIMER
+
+SHEET_RECT = fitz.paper_rect("a4-l")
+
+def fit_to_slot(original_width, original_height, width, height, maintain_aspect_ratio):
+    if maintain_aspect_ratio:
+        aspect_ratio = original_width / original_height
+        scaled_height = height
+        scaled_width = height * aspect_ratio
+
+        if scaled_width > width:
+            scaled_width = width
+            scaled_height = width / aspect_ratio
+    else:
+        scaled_width = width
+        scaled_height = height
+    return scaled_width, scaled_height
+
+def create_vector_page(out_doc, pdf_reader, sheet_layout, timer=NULL_TIMER, duplicates=None):
+    # sheet_layout is an imposition.SheetLayout saying where each page goes.
+    # duplicates is an optional dedup.DuplicatePages; a repeated page is placed from its first copy,
+    # and fitz reuses the form XObject it already made for that page in out_doc
+    sheet = out_doc.new_page(width=sheet_layout.width, height=sheet_layout.height)
+
+    for page_num, rect in sheet_layout.slots:
+        if duplicates is not None:
+            page_num = duplicates.canonical.get(page_num, page_num)
+        add_page_to_sheet(sheet, pdf_reader, page_num, fitz.Rect(rect), timer)
+
+    draw_separators(sheet, sheet_layout.lines, timer)
+    return sheet
+
+def draw_separators(sheet, lines, timer=NULL_TIMER):
+    if lines:
+        with timer.stage("draw"):
+            for x0, y0, x1, y1 in lines:
+                sheet.draw_line(fitz.Point(x0, y0), fitz.Point(x1, y1), color=(0, 0, 0), width=1)
+
+def add_page_to_sheet(sheet, pdf_reader, page_num, target, timer=NULL_TIMER):
+    # Placed from the page's own document, which is not pdf_reader when several inputs are streamed
+    source_doc, source_num = locate_page(pdf_reader, page_num)
+
+    # show_pdf_page embeds the source page as a form XObject, so nothing is rasterized
+    with timer.stage("place"):
+        sheet.show_pdf_page(target, source_doc, source_num, keep_proportion=False)
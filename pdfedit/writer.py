@@ -0,0 +1,187 @@
+import hashlib
+import re
+import threading
+import zlib
+from .timing import StageQueue
+
+_REF = re.compile(rb"(\d+)\s+0\s+R")
+_LENGTH = re.compile(rb"/Length\s+\d+(?:\s+0\s+R)?")
+_PARENT = re.compile(rb"/Parent\s+\d+\s+0\s+R")
+
+def _annotations(doc, page_xref):
+    # xrefs of the page's annotations, and of its /Annots array if that is an object of its own
+    kind, value = doc.xref_get_key(page_xref, "Annots")
+    if kind == "xref":
+        array_xref = int(value.split()[0])
+        return [array_xref] + [int(ref) for ref in _REF.findall(doc.xref_object(array_xref, compressed=True).encode("latin-1"))]
+    if kind == "array":
+        return [int(ref) for ref in _REF.findall(value.encode("latin-1"))]
+    return []
+
+class StreamingPdfWriter:
+    # Writes sheets to disk as soon as they are added. Only the byte offset and a digest of each
+    # written object and the page numbers are kept, so memory does not grow with the
+    # size of the sheets. Objects that repeat across sheets (images with their colour spaces and
+    # soft masks, fonts with their font files) are written once and shared: every object is hashed
+    # after the objects it refers to, with those references already replaced by their numbers in
+    # the output, so two copies of a whole subgraph come out identical.
+    # With queue_size the file is written by a thread of its own: add_page only collects the objects
+    # and queues them, up to queue_size of them, so the caller goes back to rendering while the disk
+    # catches up. write_queue is the timing.StageQueue between the two.
+
+    def __init__(self, output_pdf, queue_size=0):
+        self.out_f = open(output_pdf, "wb")
+        self.offsets = [None, None, None]  # object 0 is the free-list head, 1 the catalog, 2 the page tree
+        self.kids = []
+        self.shared_objects = {}  # digest of an object as written -> its number in the output
+        self.out_f.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self.write_queue = None
+        self._thread = None
+        self._error = None
+        if queue_size > 0:
+            self._stop = threading.Event()
+            self.write_queue = StageQueue(queue_size, self._stop)
+            self._thread = threading.Thread(target=self._write_loop, daemon=True)
+            self._thread.start()
+
+    def _reserve(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def _write_object(self, num, body, stream=None):
+        if self._thread is None:
+            self._emit(num, body, stream)
+            return
+        self._queue_write((num, body, stream))
+
+    def _queue_write(self, item):
+        try:
+            self.write_queue.put(item)
+        except StageQueue.Stopped:
+            raise self._error or OSError("output writer stopped")
+
+    def _write_loop(self):
+        try:
+            while True:
+                item = self.write_queue.get()
+                if item is None:
+                    return
+                self._emit(*item)
+        except StageQueue.Stopped:
+            pass
+        except BaseException as e:
+            self._error = e
+            self._stop.set()
+
+    def _finish_writes(self, abort=False):
+        # Waits for the writer thread to empty its queue, or just stops it when abort is set.
+        # Anything written after this goes straight to the file.
+        if self._thread is None:
+            return
+        if abort:
+            self._stop.set()
+        else:
+            self._queue_write(None)
+        self._thread.join()
+        self._thread = None
+        if self._error is not None and not abort:
+            self.out_f.close()
+            raise self._error
+
+    def _emit(self, num, body, stream=None):
+        self.offsets[num] = self.out_f.tell()
+        self.out_f.write(b"%d 0 obj\n" % num)
+        self.out_f.write(body)
+        if stream is not None:
+            self.out_f.write(b"\nstream\n")
+            self.out_f.write(stream)
+            self.out_f.write(b"\nendstream")
+        self.out_f.write(b"\nendobj\n")
+
+    def add_page(self, doc, pno):
+        # Copies page pno of an open fitz document, with everything it references. The page and its
+        # annotations belong to this sheet alone and are never shared, and neither is anything on a
+        # reference cycle (an annotation's /P back to its page): those get their number before
+        # their content is known.
+        page_xref = doc[pno].xref
+        own = {page_xref, *_annotations(doc, page_xref)}
+        numbers = {}
+        loaded = {}
+        done = set()
+        stack = [page_xref]
+        while stack:
+            xref = stack[-1]
+            if xref in done:
+                stack.pop()
+                continue
+            if xref not in loaded:
+                body = doc.xref_object(xref, compressed=True).encode("latin-1")
+                stream = doc.xref_stream_raw(xref) if doc.xref_is_stream(xref) else None
+                if stream is not None and doc.xref_get_key(xref, "Filter")[0] == "null":
+                    # Stored uncompressed; deflated like fitz's save(deflate=True) would
+                    stream = zlib.compress(stream, 6)
+                    body = body.rstrip()[:-2] + b"/Filter/FlateDecode>>"
+                if stream is not None:
+                    body = _LENGTH.sub(b"/Length %d" % len(stream), body, count=1)
+                if xref == page_xref:
+                    body = _PARENT.sub(b"", body, count=1)
+                refs = [int(m.group(1)) for m in _REF.finditer(body)]
+                loaded[xref] = (body, stream, refs)
+                stack.extend(ref for ref in refs if ref not in done and ref not in loaded)
+                continue
+            stack.pop()
+            body, stream, refs = loaded.pop(xref)
+            for ref in refs:
+                if ref not in numbers:
+                    # Still being copied further up: a cycle
+                    numbers[ref] = self._reserve()
+            body = _REF.sub(lambda m: b"%d 0 R" % numbers[int(m.group(1))], body)
+            if xref == page_xref:
+                body = body.rstrip()
+                body = body[:-2] + b"/Parent 2 0 R>>"
+            if xref in own or xref in numbers:
+                if xref not in numbers:
+                    numbers[xref] = self._reserve()
+                self._write_object(numbers[xref], body, stream)
+            else:
+                h = hashlib.sha1(body)
+                if stream is not None:
+                    h.update(b"stream")
+                    h.update(stream)
+                digest = h.digest()
+                num = self.shared_objects.get(digest)
+                if num is None:
+                    num = self.shared_objects[digest] = self._reserve()
+                    self._write_object(num, body, stream)
+                numbers[xref] = num
+            done.add(xref)
+        self.kids.append(numbers[page_xref])
+
+    def insert_pdf(self, doc):
+        # Same name as fitz.Document.insert_pdf so the engine can use either as its output
+        for pno in range(len(doc)):
+            self.add_page(doc, pno)
+
+    def close(self):
+        self._finish_writes()
+        kids = b" ".join(b"%d 0 R" % num for num in self.kids)
+        self._write_object(1, b"<</Type/Catalog/Pages 2 0 R>>")
+        self._write_object(2, b"<</Type/Pages/Kids[%s]/Count %d>>" % (kids, len(self.kids)))
+
+        xref_offset = self.out_f.tell()
+        self.out_f.write(b"xref\n0 %d\n" % len(self.offsets))
+        self.out_f.write(b"0000000000 65535 f \n")
+        for offset in self.offsets[1:]:
+            self.out_f.write(b"%010d 00000 n \n" % offset)
+        self.out_f.write(b"trailer\n<</Size %d/Root 1 0 R>>\nstartxref\n%d\n%%%%EOF\n" % (len(self.offsets), xref_offset))
+        self.out_f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._finish_writes(abort=True)
+            self.out_f.close()
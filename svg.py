@@ -1,83 +1,38 @@
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-from ttkthemes import ThemedTk
-from PyPDF2 import PdfReader, PdfWriter
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import landscape, A4
-from PIL import Image
 import fitz  # PyMuPDF
-import tempfile
-import os
-import threading
-
-def create_combined_page(pdf_reader, page_numbers, separate_with_line, dpi, maintain_aspect_ratio):
-    packet = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-    can = canvas.Canvas(packet.name, pagesize=landscape(A4))
-    page_width, page_height = landscape(A4)
-
-    for index, page_num in enumerate(page_numbers):
-        if page_num < len(pdf_reader):
-            x_offset = (page_width / len(page_numbers)) * index
-            add_page_to_canvas(pdf_reader, page_num, x_offset, page_width / len(page_numbers), page_height, can, dpi, maintain_aspect_ratio)
-
-    if separate_with_line and len(page_numbers) > 1:
-        line_x = page_width / len(page_numbers)
-        can.setStrokeColor("black")
-        can.setLineWidth(1)
-        for i in range(1, len(page_numbers)):
-            can.line(line_x * i, 0, line_x * i, page_height)
-
-    can.save()
-    return packet.name
-
-def add_page_to_canvas(pdf_reader, page_num, x_offset, width, height, can, dpi, maintain_aspect_ratio):
-    page = pdf_reader.load_page(page_num)
-    pix = page.get_pixmap(dpi=dpi)
-    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-    original_width, original_height = img.size
-    aspect_ratio = original_width / original_height
-    if maintain_aspect_ratio:
-        scaled_height = height
-        scaled_width = height * aspect_ratio
-
-        if scaled_width > width:
-            scaled_width = width
-            scaled_height = width / aspect_ratio
+from pdfedit import engine
+from pdfedit.tkprogress import ProgressChannel, format_eta
+
+def reformat_pdf(input_pdf, output_pdf, num_pages, separate_with_line, dpi, maintain_aspect_ratio, rasterize, channel):
+    # Runs on the worker thread: everything it reports goes through the channel, errors are raised to it.
+    # Raster pages are rendered by the engine within its pixel budget, so the top DPI settings
+    # finish instead of running out of memory.
+    with fitz.open(input_pdf) as doc:
+        channel.total_pages = len(doc)
+    engine.reformat_pdf(input_pdf, output_pdf, num_pages, separate_with_line, dpi, maintain_aspect_ratio, rasterize=rasterize, progress=channel.report, cancel=channel.cancel_event)
+
+def show_progress(percent, pages_per_second, eta):
+    progress.set(percent)
+    status_label.config(text=f"Processing... {percent:.0f}%  ·  {pages_per_second:.1f} pages/s  ·  {format_eta(eta)} left", foreground="black")
+
+def finish_job(error):
+    global job
+    job = None
+    reformat_button.config(state=tk.NORMAL)
+    cancel_button.config(state=tk.DISABLED)
+    if error is None:
+        progress.set(100)
+        status_label.config(text="PDF reformatted successfully!", foreground="green")
+    elif isinstance(error, engine.Cancelled):
+        progress.set(0)
+        status_label.config(text="Cancelled.", foreground="black")
     else:
-        scaled_width = width
-        scaled_height = height
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp_file:
-        img_resized = img.resize((int(scaled_width), int(scaled_height)), Image.LANCZOS)
-        img_resized.save(tmp_file, format='PNG')
-        tmp_file_path = tmp_file.name
-
-    can.drawImage(tmp_file_path, x_offset + (width - scaled_width) / 2, 0, width=scaled_width, height=scaled_height)
-    os.remove(tmp_file_path)
-
-def reformat_pdf(input_pdf, output_pdf, num_pages, separate_with_line, dpi, maintain_aspect_ratio, progress, status_label):
-    try:
-        pdf_reader = fitz.open(input_pdf)
-        pdf_writer = PdfWriter()
-        num_total_pages = len(pdf_reader)
-        num_combined_pages = 0
-
-        for i in range(0, num_total_pages, num_pages):
-            page_numbers = range(i, min(i + num_pages, num_total_pages))
-            combined_page_path = create_combined_page(pdf_reader, page_numbers, separate_with_line, dpi, maintain_aspect_ratio)
-            combined_pdf = PdfReader(combined_page_path)
-            pdf_writer.add_page(combined_pdf.pages[0])
-            num_combined_pages += 1
-            progress.set((i + num_pages) / num_total_pages * 100)
-            os.remove(combined_page_path)
-
-        with open(output_pdf, "wb") as out_f:
-            pdf_writer.write(out_f)
+        status_label.config(text=f"Error: {str(error)}", foreground="red")
 
-        status_label.config(text="PDF reformatted successfully!", foreground="green")
-    except Exception as e:
-        status_label.config(text=f"Error: {str(e)}", foreground="red")
+def cancel_job():
+    if job is not None:
+        job.cancel()
+        cancel_button.config(state=tk.DISABLED)
+        status_label.config(text="Cancelling...", foreground="black")
 
 def select_input_pdf():
     input_pdf = filedialog.askopenfilename(filetypes=[("PDF files", "*.pdf")])
@@ -96,63 +51,86 @@ def process_pdf():
     separate_with_line = separate_var.get()
     dpi = int(dpi_var.get())
     maintain_aspect_ratio = aspect_ratio_var.get()
+    rasterize = rasterize_var.get()
     if not input_pdf or not output_pdf:
         messagebox.showerror("Error", "Please select both input and output PDF files.")
         return
+    global job
+    if job is not None:
+        return
     progress.set(0)
-    status_label.config(text="")
-    threading.Thread(target=reformat_pdf, args=(input_pdf, output_pdf, num_pages, separate_with_line, dpi, maintain_aspect_ratio, progress, status_label)).start()
+    status_label.config(text="Processing...", foreground="black")
+    reformat_button.config(state=tk.DISABLED)
+    cancel_button.config(state=tk.NORMAL)
+    job = ProgressChannel(app, show_progress, finish_job)
+    job.start(reformat_pdf, input_pdf, output_pdf, num_pages, separate_with_line, dpi, maintain_aspect_ratio, rasterize)
 
 def clear_form():
+    if job is not None:
+        return
     input_path.set("")
     output_path.set("")
     num_pages_var.set("2")
     separate_var.set(False)
     dpi_var.set("150")
     aspect_ratio_var.set(True)
+    rasterize_var.set(False)
     progress.set(0)
     status_label.config(text="")
 
-# Create themed Tk window
-app = ThemedTk(theme="breeze")  # You can choose any theme from ttkthemes
-app.title("PDF Reformatter")
+if __name__ == "__main__":
+    # The GUI libraries are only loaded for a window; the benchmarks import this module for its worker
+    import tkinter as tk
+    from tkinter import ttk, filedialog, messagebox
+    from ttkthemes import ThemedTk
+
+    # Create themed Tk window
+    app = ThemedTk(theme="breeze")  # You can choose any theme from ttkthemes
+    app.title("PDF Reformatter")
+
+    input_path = tk.StringVar()
+    output_path = tk.StringVar()
+    num_pages_var = tk.StringVar(value="2")
+    separate_var = tk.BooleanVar(value=False)
+    dpi_var = tk.StringVar(value="150")
+    aspect_ratio_var = tk.BooleanVar(value=True)
+    rasterize_var = tk.BooleanVar(value=False)
+    progress = tk.DoubleVar()
+    job = None  # the ProgressChannel of the running job
 
-input_path = tk.StringVar()
-output_path = tk.StringVar()
-num_pages_var = tk.StringVar(value="2")
-separate_var = tk.BooleanVar(value=False)
-dpi_var = tk.StringVar(value="150")
-aspect_ratio_var = tk.BooleanVar(value=True)
-progress = tk.DoubleVar()
+    # Layout and Widgets
+    tk.Label(app, text="Input PDF:").grid(row=0, column=0, padx=10, pady=10, sticky="e")
+    tk.Entry(app, textvariable=input_path, width=50).grid(row=0, column=1, padx=10, pady=10)
+    tk.Button(app, text="Browse...", command=select_input_pdf).grid(row=0, column=2, padx=10, pady=10)
 
-# Layout and Widgets
-tk.Label(app, text="Input PDF:").grid(row=0, column=0, padx=10, pady=10, sticky="e")
-tk.Entry(app, textvariable=input_path, width=50).grid(row=0, column=1, padx=10, pady=10)
-tk.Button(app, text="Browse...", command=select_input_pdf).grid(row=0, column=2, padx=10, pady=10)
+    tk.Label(app, text="Output PDF:").grid(row=1, column=0, padx=10, pady=10, sticky="e")
+    tk.Entry(app, textvariable=output_path, width=50).grid(row=1, column=1, padx=10, pady=10)
+    tk.Button(app, text="Browse...", command=select_output_pdf).grid(row=1, column=2, padx=10, pady=10)
 
-tk.Label(app, text="Output PDF:").grid(row=1, column=0, padx=10, pady=10, sticky="e")
-tk.Entry(app, textvariable=output_path, width=50).grid(row=1, column=1, padx=10, pady=10)
-tk.Button(app, text="Browse...", command=select_output_pdf).grid(row=1, column=2, padx=10, pady=10)
+    tk.Label(app, text="Pages to combine:").grid(row=2, column=0, padx=10, pady=10, sticky="e")
+    tk.Entry(app, textvariable=num_pages_var, width=5).grid(row=2, column=1, padx=10, pady=10, sticky="w")
 
-tk.Label(app, text="Pages to combine:").grid(row=2, column=0, padx=10, pady=10, sticky="e")
-tk.Entry(app, textvariable=num_pages_var, width=5).grid(row=2, column=1, padx=10, pady=10, sticky="w")
+    tk.Label(app, text="Output Quality (DPI):").grid(row=3, column=0, padx=10, pady=10, sticky="e")
+    dpi_dropdown = ttk.Combobox(app, textvariable=dpi_var, values=["72", "150", "300", "600", "1200", "2500", "5000"])
+    dpi_dropdown.grid(row=3, column=1, padx=10, pady=10, sticky="w")
+    dpi_dropdown.set("150")
 
-tk.Label(app, text="Output Quality (DPI):").grid(row=3, column=0, padx=10, pady=10, sticky="e")
-dpi_dropdown = ttk.Combobox(app, textvariable=dpi_var, values=["72", "150", "300", "600", "1200", "2500", "5000"])
-dpi_dropdown.grid(row=3, column=1, padx=10, pady=10, sticky="w")
-dpi_dropdown.set("150")
+    tk.Checkbutton(app, text="Separate pages with a line", variable=separate_var).grid(row=4, column=1, padx=10, pady=10, sticky="w")
 
-tk.Checkbutton(app, text="Separate pages with a line", variable=separate_var).grid(row=4, column=1, padx=10, pady=10, sticky="w")
+    tk.Checkbutton(app, text="Maintain aspect ratio", variable=aspect_ratio_var).grid(row=5, column=1, padx=10, pady=10, sticky="w")
 
-tk.Checkbutton(app, text="Maintain aspect ratio", variable=aspect_ratio_var).grid(row=5, column=1, padx=10, pady=10, sticky="w")
+    tk.Checkbutton(app, text="Rasterize pages", variable=rasterize_var).grid(row=6, column=1, padx=10, pady=10, sticky="w")
 
-tk.Button(app, text="Reformat PDF", command=process_pdf).grid(row=6, column=1, pady=20, sticky="e")
-tk.Button(app, text="Clear", command=clear_form).grid(row=6, column=2, pady=20, sticky="w")
+    cancel_button = tk.Button(app, text="Cancel", command=cancel_job, state=tk.DISABLED)
+    cancel_button.grid(row=7, column=0, pady=20, sticky="e")
+    reformat_button = tk.Button(app, text="Reformat PDF", command=process_pdf)
+    reformat_button.grid(row=7, column=1, pady=20, sticky="e")
+    tk.Button(app, text="Clear", command=clear_form).grid(row=7, column=2, pady=20, sticky="w")
 
-progress_bar = ttk.Progressbar(app, orient="horizontal", length=400, mode="determinate", variable=progress)
-progress_bar.grid(row=7, column=0, columnspan=3, padx=10, pady=10)
+    progress_bar = ttk.Progressbar(app, orient="horizontal", length=400, mode="determinate", variable=progress)
+    progress_bar.grid(row=8, column=0, columnspan=3, padx=10, pady=10)
 
-status_label = tk.Label(app, text="")
-status_label.grid(row=8, column=0, columnspan=3, padx=10, pady=10)
+    status_label = tk.Label(app, text="")
+    status_label.grid(row=9, column=0, columnspan=3, padx=10, pady=10)
 
-app.mainloop()
+    app.mainloop()
@@ -0,0 +1,53 @@
+import os
+import zlib
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from pdfedit import cache
+from pdfedit.cache import RenderCache
+
+def _image(width, height, shade=128):
+    return Image.new("RGB", (width, height), (shade, shade, shade))
+
+def test_disk_entries_survive_a_new_cache(tmp_path):
+    RenderCache(str(tmp_path)).put("a" * 64, 3, _image(40, 60))
+    reopened = RenderCache(str(tmp_path))
+    assert reopened.get("a" * 64, 3, (40, 60)).size == (40, 60)
+    # A smaller size is scaled down from the larger entry
+    assert reopened.get("a" * 64, 3, (20, 30)).size == (20, 30)
+    assert reopened.get("a" * 64, 3, (80, 120)) is None
+    assert reopened.get("a" * 64, 4, (40, 60)) is None
+
+def test_lookups_do_not_list_the_directory(tmp_path, monkeypatch):
+    digest = "b" * 64
+    writer = RenderCache(str(tmp_path))
+    for page_num in range(20):
+        writer.put(digest, page_num, _image(40, 60))
+    reader = RenderCache(str(tmp_path), memory_limit=0)
+
+    def listing(*args):
+        raise AssertionError("directory listed on lookup")
+    monkeypatch.setattr(cache.os, "listdir", listing)
+    monkeypatch.setattr(cache.os, "scandir", listing)
+    for page_num in range(20):
+        assert reader.get(digest, page_num, (30, 45)).size == (30, 45)
+    assert reader.get(digest, 99, (30, 45)) is None
+    # An entry another process stored after this cache opened is still found at its exact size
+    writer.put(digest, 50, _image(40, 60))
+    assert reader.get(digest, 50, (40, 60)).size == (40, 60)
+
+def test_eviction_keeps_the_index_in_step(tmp_path):
+    digest = "c" * 64
+    noisy = [Image.frombytes("RGB", (64, 64), os.urandom(64 * 64 * 3)) for _ in range(10)]
+    entry_size = len(zlib.compress(noisy[0].tobytes(), 1))
+    store = RenderCache(str(tmp_path), memory_limit=0, disk_limit=entry_size * 4)
+    for page_num, image in enumerate(noisy):
+        store.put(digest, page_num, image)
+    on_disk = [name for name in os.listdir(tmp_path) if name.endswith(".rgbz")]
+    assert store.disk_size == sum(os.path.getsize(os.path.join(tmp_path, name)) for name in on_disk)
+    assert store.disk_size <= store.disk_limit
+    assert sum(len(sizes) for sizes in store.disk_entries.values()) == len(on_disk)
+    # The newest entry is kept, the oldest evicted
+    assert store.get(digest, 9, (64, 64)) is not None
+    assert store.get(digest, 0, (64, 64)) is None
@@ -0,0 +1,68 @@
+import logging
+import os
+import threading
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+from pdfedit import engine
+
+def _sample(path, num_pages=9):
+    # Pages of two sizes with a line of text each, so the layout has something to fit, and the same
+    # logo on every page, which every worker chunk brings its own copy of
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 64), False)
+    pix.set_rect(pix.irect, (30, 90, 200))
+    logo = pix.tobytes("png")
+    doc = fitz.open()
+    for page_num in range(num_pages):
+        page = doc.new_page(width=595 if page_num % 3 else 842, height=842 if page_num % 3 else 595)
+        page.insert_text((72, 72), f"page {page_num + 1}", fontsize=24)
+        page.insert_image(fitz.Rect(72, 100, 172, 200), stream=logo)
+    doc.save(path)
+    doc.close()
+    return path
+
+def _sheets(path):
+    with fitz.open(path) as doc:
+        return [tuple(page.rect) for page in doc]
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize("checkpoint", [False, True])
+def test_workers(tmp_path, streaming, checkpoint):
+    input_pdf = _sample(str(tmp_path / "in.pdf"))
+    output_pdf = str(tmp_path / "out.pdf")
+    checkpoint_dir = str(tmp_path / "checkpoint") if checkpoint else None
+    engine.reformat_pdf(input_pdf, output_pdf, num_pages=2, workers=2, streaming=streaming, checkpoint_dir=checkpoint_dir)
+    assert len(_sheets(output_pdf)) == 5
+
+@pytest.mark.parametrize("rasterize", [False, True])
+def test_workers_match_serial(tmp_path, rasterize):
+    input_pdf = _sample(str(tmp_path / "in.pdf"), num_pages=13)
+    outputs = {}
+    for workers in (1, 2):
+        outputs[workers] = str(tmp_path / f"out{workers}.pdf")
+        engine.reformat_pdf(input_pdf, outputs[workers], num_pages=3, dpi=50, rasterize=rasterize, workers=workers)
+    assert _sheets(outputs[2]) == _sheets(outputs[1])
+    with fitz.open(outputs[1]) as serial, fitz.open(outputs[2]) as parallel:
+        for serial_page, parallel_page in zip(serial, parallel):
+            assert parallel_page.get_pixmap(dpi=20).samples == serial_page.get_pixmap(dpi=20).samples
+    # The saved output holds the logo once, however many chunks brought it
+    assert os.path.getsize(outputs[2]) <= os.path.getsize(outputs[1]) * 1.1
+
+def _interrupted(input_pdf, output_pdf, checkpoint_dir, pixel_budget):
+    # Cancelled once the first sheet is in the checkpoint
+    cancel = threading.Event()
+    with pytest.raises(engine.Cancelled):
+        engine.reformat_pdf(input_pdf, output_pdf, num_pages=2, dpi=50, rasterize=True, checkpoint_dir=checkpoint_dir, pixel_budget=pixel_budget,
+                            progress=lambda percent: cancel.set(), cancel=cancel)
+
+@pytest.mark.parametrize("budget, resumed", [(1 << 20, True), (1 << 16, False)])
+def test_checkpoint_resumes_only_with_the_same_pixel_budget(tmp_path, caplog, budget, resumed):
+    input_pdf = _sample(str(tmp_path / "in.pdf"))
+    output_pdf = str(tmp_path / "out.pdf")
+    checkpoint_dir = str(tmp_path / "checkpoint")
+    _interrupted(input_pdf, output_pdf, checkpoint_dir, 1 << 20)
+    with caplog.at_level(logging.INFO):
+        engine.reformat_pdf(input_pdf, output_pdf, num_pages=2, dpi=50, rasterize=True, checkpoint_dir=checkpoint_dir, pixel_budget=budget)
+    assert ("Resuming from checkpoint" in caplog.text) == resumed
+    assert len(_sheets(output_pdf)) == 5
@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip("fitz")
+
+from pdfedit.imposition import EMPTY, ImpositionPlan, Layout, impose_order, sheet_count
+
+def test_booklet_order():
+    layout = Layout(order="booklet")
+    assert impose_order(layout, range(8)) == [(7, 0), (1, 6), (5, 2), (3, 4)]
+
+def test_booklet_pads_to_whole_folded_sheets():
+    layout = Layout(order="booklet")
+    assert impose_order(layout, range(5)) == [(EMPTY, 0), (1, EMPTY), (EMPTY, 2), (3, 4)]
+
+def test_sequential_grid_order():
+    layout = Layout(rows=2, cols=2)
+    assert impose_order(layout, range(5)) == [(0, 1, 2, 3), (4,)]
+
+@pytest.mark.parametrize("layout", [Layout(), Layout(rows=2, cols=3), Layout(order="booklet")])
+@pytest.mark.parametrize("num_pages", [1, 2, 3, 4, 5, 8, 13])
+def test_sheet_count_matches_impose_order(layout, num_pages):
+    assert sheet_count(layout, num_pages) == len(impose_order(layout, range(num_pages)))
+
+def test_booklet_needs_two_slots():
+    with pytest.raises(ValueError):
+        ImpositionPlan(Layout(rows=2, cols=2, order="booklet"), range(4), lambda page_num: (100, 100))
+
+def test_short_last_sheet_spreads_over_the_row():
+    layout = Layout(rows=1, cols=2, sheet_width=200, sheet_height=100)
+    plan = ImpositionPlan(layout, range(3), lambda page_num: (100, 100))
+    assert plan.sheet(0).slots == ((0, (0, 0, 100, 100)), (1, (100, 0, 200, 100)))
+    assert plan.sheet(1).slots == ((2, (50, 0, 150, 100)),)
+
+def test_grid_with_margin_and_gutter():
+    layout = Layout(rows=2, cols=2, sheet_width=220, sheet_height=120, margin=10, gutter=20, separate_with_line=True)
+    sizes = {0: (90, 40), 1: (90, 90), 2: (180, 40), 3: (90, 40)}
+    sheet = ImpositionPlan(layout, range(4), sizes.__getitem__).sheet(0)
+    assert (sheet.width, sheet.height) == (220, 120)
+    assert sheet.slots == (
+        (0, (10, 10, 100, 50)),
+        # Narrower than its slot: centred
+        (1, (145, 10, 185, 50)),
+        # Wider: bottom-aligned
+        (2, (10, 90, 100, 110)),
+        (3, (120, 70, 210, 110)),
+    )
+    assert sheet.lines == ((110, 10, 110, 110), (10, 60, 210, 60))
+
+def test_sheet_indices_only_ask_for_the_pages_needed():
+    asked = []
+    def page_size(page_num):
+        asked.append(page_num)
+        return (100, 100)
+    plan = ImpositionPlan(Layout(), range(10), page_size, sheet_indices=[3])
+    assert plan.num_sheets == 5
+    assert len(plan) == 1
+    assert sorted(asked) == [6, 7]
+    assert plan.page_numbers(3) == [6, 7]
+    with pytest.raises(KeyError):
+        plan.sheet(0)
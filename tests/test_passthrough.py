@@ -0,0 +1,42 @@
+import io
+import pytest
+
+fitz = pytest.importorskip("fitz")
+Image = pytest.importorskip("PIL.Image")
+
+from pdfedit import engine
+from pdfedit.passthrough import copy_image_xobject, find_scanned_image
+
+def _scan(path, num_pages=2):
+    # Scanner-like pages: one JPEG covering the whole page, inserted the way PyMuPDF does it, with
+    # its ICC colour space in an object of its own
+    buffer = io.BytesIO()
+    Image.new("RGB", (200, 280), (200, 30, 30)).save(buffer, format="JPEG")
+    doc = fitz.open()
+    for _ in range(num_pages):
+        page = doc.new_page(width=200, height=280)
+        page.insert_image(page.rect, stream=buffer.getvalue())
+    doc.save(path)
+    doc.close()
+    return path
+
+def test_copy_keeps_the_jpeg_stream(tmp_path):
+    with fitz.open(_scan(str(tmp_path / "scan.pdf"))) as src:
+        xref = find_scanned_image(src[0])
+        assert src.xref_get_key(xref, "ColorSpace")[0] == "xref"
+        out = fitz.open()
+        new_xref = copy_image_xobject(out, src, xref)
+        assert new_xref is not None
+        assert out.xref_get_key(new_xref, "Filter") == ("name", "/DCTDecode")
+        assert out.xref_stream_raw(new_xref) == src.xref_stream_raw(xref)
+        assert out.xref_get_key(new_xref, "ColorSpace")[1].startswith("[/ICCBased")
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_scans_pass_through(tmp_path, streaming):
+    input_pdf = _scan(str(tmp_path / "scan.pdf"))
+    output_pdf = str(tmp_path / "out.pdf")
+    engine.reformat_pdf(input_pdf, output_pdf, num_pages=2, rasterize=True, passthrough=True, streaming=streaming)
+    with fitz.open(output_pdf) as out:
+        assert len(out) == 1
+        filters = {image[8] for image in out[0].get_images(full=True)}
+        assert filters == {"DCTDecode"}
@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip("fitz")
+
+from pdfedit.batch import parse_ranges
+
+@pytest.mark.parametrize("text, count, expected", [
+    ("1-3,7", 10, [0, 1, 2, 6]),
+    ("-5", 10, [0, 1, 2, 3, 4]),
+    ("10-", 12, [9, 10, 11]),
+    ("3", 10, [2]),
+    ("2-4,3,1", 10, [0, 1, 2, 3]),
+    (" 1 , 4- ", 5, [0, 3, 4]),
+    # Numbers past the end are left out
+    ("8-20", 10, [7, 8, 9]),
+])
+def test_parse_ranges(text, count, expected):
+    assert parse_ranges(text, count) == expected
+
+@pytest.mark.parametrize("text", ["5-3", "0", "0-2", "a-b", "1-x", "1-2-3"])
+def test_bad_ranges(text):
+    with pytest.raises(ValueError):
+        parse_ranges(text, 10)
+
+@pytest.mark.parametrize("text", ["15", "11-", "", ","])
+def test_ranges_that_select_nothing(text):
+    with pytest.raises(ValueError):
+        parse_ranges(text, 10)
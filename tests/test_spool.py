@@ -0,0 +1,36 @@
+import json
+import os
+import pytest
+
+from pdfedit.spool import SpoolService, job_settings
+
+def _job(directory, settings, name="job.pdf"):
+    input_pdf = os.path.join(directory, name)
+    with open(input_pdf, "wb") as f:
+        f.write(b"%PDF-1.7\n")
+    with open(input_pdf[:-len(".pdf")] + ".json", "w") as f:
+        f.write(settings if isinstance(settings, str) else json.dumps(settings))
+    return input_pdf
+
+def test_settings_from_name_and_sidecar(tmp_path):
+    input_pdf = _job(str(tmp_path), {"dpi": "200", "rasterize": "yes"}, name="manual.4up.lines.pdf")
+    settings = job_settings(input_pdf, {"dpi": 150})
+    assert settings == {"dpi": 200, "num_pages": 4, "separate_with_line": True, "rasterize": True}
+
+@pytest.mark.parametrize("sidecar", ['{"dpi": null}', '{"dpi": [1]}', '{"dpi": "many"}', '{"rasterize": {}}', '[1, 2]', '"4up"', '{"dpi": ', '{"colour": 1}'])
+def test_bad_sidecar(tmp_path, sidecar):
+    with pytest.raises(ValueError):
+        job_settings(_job(str(tmp_path), sidecar), {})
+
+def test_bad_sidecar_fails_only_its_job(tmp_path):
+    input_dir, output_dir = str(tmp_path / "in"), str(tmp_path / "out")
+    service = SpoolService(input_dir, output_dir)
+    _job(input_dir, '{"dpi": null}', name="bad.pdf")
+    good = _job(input_dir, {"dpi": 300}, name="good.pdf")
+    # A file is queued on the second poll that sees it unchanged
+    service.scan()
+    service.scan()
+    assert sorted(os.listdir(service.failed_dir)) == ["bad.json", "bad.pdf", "bad.pdf.error.txt"]
+    with open(os.path.join(service.failed_dir, "bad.pdf.error.txt")) as f:
+        assert "dpi" in f.read()
+    assert [job[0] for job in service.queue] == [good]
@@ -0,0 +1,40 @@
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+from pdfedit.writer import StreamingPdfWriter
+
+def _source(text, image):
+    # A document of its own for every page, so the writer sees the same image under different xrefs
+    doc = fitz.open()
+    page = doc.new_page(width=200, height=100)
+    page.insert_image(fitz.Rect(10, 10, 60, 60), stream=image)
+    page.insert_text((80, 50), text)
+    # An annotation points back to its page: a cycle the writer has to copy per sheet
+    page.insert_link({"kind": fitz.LINK_URI, "from": fitz.Rect(80, 60, 120, 80), "uri": "https://example.com"})
+    return doc
+
+@pytest.mark.parametrize("queue_size", [0, 2])
+def test_round_trip_shares_repeated_objects(tmp_path, queue_size):
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 8, 8), False)
+    pix.clear_with(200)
+    image = pix.tobytes("png")
+    sources = [_source(text, image) for text in ("first", "second", "third")]
+
+    output_pdf = tmp_path / "out.pdf"
+    with StreamingPdfWriter(str(output_pdf), queue_size) as writer:
+        for doc in sources:
+            writer.insert_pdf(doc)
+    assert writer.shared_objects
+
+    with fitz.open(str(output_pdf)) as out:
+        assert len(out) == 3
+        assert [page.rect for page in out] == [fitz.Rect(0, 0, 200, 100)] * 3
+        assert [page.get_text().strip() for page in out] == ["first", "second", "third"]
+        images = [xref for xref in range(1, out.xref_length()) if out.xref_get_key(xref, "Subtype") == ("name", "/Image")]
+        assert len(images) == 1
+        assert {page.get_images()[0][0] for page in out} == set(images)
+        # The image's ICC colour space is shared along with it
+        assert len({out.xref_get_key(xref, "ColorSpace")[1] for xref in images}) == 1
+        assert [len(page.get_links()) for page in out] == [1, 1, 1]
+        assert len({page.get_links()[0]["xref"] for page in out}) == 3